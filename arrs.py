@@ -1,250 +1,489 @@
 import os
+import threading
+import time
+from collections import OrderedDict
 import requests
 from dotenv import load_dotenv
+from metrics import ARR_FAILURES
+from download import preallocate
+from tracing import span
 
 load_dotenv()
-sonarr_enabled = bool(os.getenv('SONARR'))
-radarr_enabled = bool(os.getenv('RADARR'))
-radarr_folder = os.path.join(os.getenv('ARR_TORRENTS_PATH'), 'radarr')
-sonarr_folder = os.path.join(os.getenv('ARR_TORRENTS_PATH'), 'sonarr')
-SONARR_API_KEY = os.getenv('SONARR_API')
-SONARR_BASE_URL = os.getenv('SONARR_BASE_URL')
-RADARR_API_KEY = os.getenv('RADARR_API')
-RADARR_BASE_URL = os.getenv('RADARR_BASE_URL')
 torrent_path = os.getenv('ARR_TORRENTS_PATH')
 download_path = os.getenv('ARR_DOWNLOAD_PATH')
+history_cache_size = int(os.getenv('ARR_HISTORY_CACHE_SIZE', 5000))
+failure_report_window = float(os.getenv('ARR_FAILURE_WINDOW', 5))
+arr_instance_names = [name.strip() for name in os.getenv('ARR_INSTANCES', '').split(',') if name.strip()]
 
 
-def arrs_folders():
-    enabled = {
-        'sonarr' : sonarr_enabled,
-        'radarr' : radarr_enabled
-    }
-    for key, value in enabled.items():
-        torrent_folder = os.path.join(torrent_path, key)
-        download_folder = os.path.join(download_path, key)
-        if value:
-            os.makedirs(torrent_folder, exist_ok=True)
-            os.makedirs(download_folder, exist_ok=True)
+class ArrHistoryCache:
+    """
+    Grab history of one Sonarr/Radarr instance, indexed by sourceTitle and downloadId (the infohash).
+
+    The cache is filled with paged history fetches on first use and refreshed incrementally,
+    newest first, until it reaches the newest record it already knows. It holds at most
+    max_records records and evicts the least recently used one when full.
+    """
+
+    def __init__(self, name, base_url, api_key, max_records=history_cache_size, page_size=250, min_refresh_interval=5):
+        self.name = name
+        self.base_url = base_url
+        self.max_records = max_records
+        self.page_size = page_size
+        self.min_refresh_interval = min_refresh_interval
+        self.session = requests.Session()
+        self.session.headers["X-Api-Key"] = api_key or ""
+        self.lock = threading.Lock()
+        self.records = OrderedDict()  # record id -> record, least recently used first
+        self.by_title = {}
+        self.by_download_id = {}
+        self.newest_id = 0
+        self.last_refresh = 0
+
+    def find(self, release_title=None, download_id=None):
+        """
+        Return the grab record for a release title or infohash.
+        Only a cache miss triggers an (incremental) history fetch.
+        """
+        with self.lock:
+            record = self._lookup(release_title, download_id)
+            if record is None and time.monotonic() - self.last_refresh >= self.min_refresh_interval:
+                self._refresh()
+                record = self._lookup(release_title, download_id)
+            return record
+
+    def _lookup(self, release_title, download_id):
+        record_id = None
+        if download_id:
+            record_id = self.by_download_id.get(download_id.lower())
+        if record_id is None and release_title:
+            record_id = self.by_title.get(release_title)
+        if record_id is None:
+            return None
+        self.records.move_to_end(record_id)
+        return self.records[record_id]
+
+    def _refresh(self):
+        """
+        Fetch history pages newest first until a known record is reached or the cache is full.
+        The new records are added oldest first, so the newest grabs are the last to be evicted.
+        """
+        self.last_refresh = time.monotonic()
+        history_url = f"{self.base_url}/api/v3/history"
+        fetched = []  # New records, newest first
+        page = 1
+        while len(fetched) < self.max_records:
+            params = {"page": page, "pageSize": self.page_size, "sortKey": "date",
+                      "sortDirection": "descending", "eventType": 1}
+            response = self.session.get(history_url, params=params)
+            response.raise_for_status()
+            records = response.json()["records"]
+            for record in records:
+                if record["id"] <= self.newest_id or len(fetched) >= self.max_records:
+                    break
+                fetched.append(record)
+            else:
+                if len(records) == self.page_size:
+                    page += 1
+                    continue
+            break
+        for record in reversed(fetched):
+            self._add(record)
+            self.newest_id = max(self.newest_id, record["id"])
+
+    def _add(self, record):
+        self.records[record["id"]] = record
+        self.records.move_to_end(record["id"])
+        self.by_title[record["sourceTitle"]] = record["id"]
+        if record.get("downloadId"):
+            self.by_download_id[record["downloadId"].lower()] = record["id"]
+        while len(self.records) > self.max_records:
+            _, evicted = self.records.popitem(last=False)
+            if self.by_title.get(evicted["sourceTitle"]) == evicted["id"]:
+                del self.by_title[evicted["sourceTitle"]]
+            if evicted.get("downloadId") and self.by_download_id.get(evicted["downloadId"].lower()) == evicted["id"]:
+                del self.by_download_id[evicted["downloadId"].lower()]
+
+
+class ArrInstance:
+    """
+    One Sonarr or Radarr instance, with the folder its magnet/torrent files are dropped in,
+    the folder its files are imported to, and a cache of its grab history.
+    """
+
+    KINDS = ('sonarr', 'radarr')
+
+    def __init__(self, name, kind, base_url, api_key, torrent_folder, download_folder, enabled=True):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown arr type '{kind}' for instance '{name}'. Expected sonarr or radarr.")
+        self.name = name
+        self.kind = kind
+        self.base_url = base_url
+        self.api_key = api_key
+        self.torrent_folder = os.path.normpath(torrent_folder)
+        self.download_folder = os.path.normpath(download_folder)
+        self.enabled = enabled
+        self.history = ArrHistoryCache(name, base_url, api_key)
+        self.failures = FailureBatcher(self)
+
+    def report_failure(self, release_title, infohash=None):
+        """
+        Queue a release to be marked as failed with the next batch.
+        """
+        if not self.api_key or not self.base_url:
+            raise ValueError(f"{self.name} API key or base URL is not set in the environment variables.")
+        self.failures.add(release_title, infohash)
+
+    def search_and_mark_failed(self, releases):
+        """
+        Mark a batch of (release title, infohash) releases as failed and search for replacements.
+        """
+        if self.kind == 'sonarr':
+            results = search_and_mark_failed_in_sonarr(self, releases)
         else:
-            pass
+            results = search_and_mark_failed_in_radarr(self, releases)
+        for marked in results.values():
+            ARR_FAILURES.inc(self.name, 'marked' if marked else 'not_marked')
+        return results
+
+
+class FailureBatcher:
+    """
+    Collects the failed releases of one arr instance for `window` seconds after the first one,
+    then marks them failed together and sends one search command for everything they covered,
+    so a burst of failures doesn't become a burst of overlapping searches on the indexers.
+    """
+
+    def __init__(self, instance, window=failure_report_window):
+        self.instance = instance
+        self.window = window
+        self.pending = OrderedDict()  # (release title, infohash) -> None, in the order reported
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def add(self, release_title, infohash=None):
+        with self.lock:
+            self.pending[(release_title, infohash)] = None
+            if self.window <= 0 or self.timer is not None:
+                start_timer = False
+            else:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                start_timer = True
+        if start_timer:
+            self.timer.start()
+        elif self.window <= 0:
+            self.flush()
+
+    def flush(self):
+        """
+        Send the pending failures now.
+        """
+        with self.lock:
+            releases, self.pending = list(self.pending), OrderedDict()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not releases:
+            return
+        print(f"Reporting {len(releases)} failed releases to {self.instance.name}.")
+        try:
+            self.instance.search_and_mark_failed(releases)
+        except Exception as e:
+            print(f"Error reporting failed releases to {self.instance.name}: {e}")
+
+
+def _env_prefix(name):
+    return ''.join(c if c.isalnum() else '_' for c in name).upper()
+
+
+def load_instances():
+    """
+    Build the arr instances from the environment.
+
+    ARR_INSTANCES lists instance names. Each is configured with <NAME>_TYPE (sonarr or radarr,
+    by default guessed from the name), <NAME>_BASE_URL, <NAME>_API, and optionally
+    <NAME>_TORRENTS_PATH and <NAME>_DOWNLOAD_PATH (default: a <name> folder under
+    ARR_TORRENTS_PATH and ARR_DOWNLOAD_PATH). Without ARR_INSTANCES, the single Sonarr and
+    Radarr set by SONARR/RADARR are used.
+    """
+    names = arr_instance_names or ['sonarr', 'radarr']
+    legacy = not arr_instance_names
+
+    instances = []
+    for name in names:
+        prefix = _env_prefix(name)
+        kind = (os.getenv(f'{prefix}_TYPE') or ('radarr' if 'radarr' in name.lower() else 'sonarr')).lower()
+        instances.append(ArrInstance(
+            name, kind, os.getenv(f'{prefix}_BASE_URL'), os.getenv(f'{prefix}_API'),
+            os.getenv(f'{prefix}_TORRENTS_PATH') or os.path.join(torrent_path, name),
+            os.getenv(f'{prefix}_DOWNLOAD_PATH') or os.path.join(download_path, name),
+            enabled=bool(os.getenv(prefix)) if legacy else True))
+    return instances
+
+
+arr_instances = load_instances()
+# (folder, instance) for every torrent and download folder, longest first, so nested folders win
+arr_routes = sorted(
+    [(instance.torrent_folder, instance) for instance in arr_instances] +
+    [(instance.download_folder, instance) for instance in arr_instances],
+    key=lambda route: len(route[0]), reverse=True)
+
+
+def find_instance(path):
+    """
+    Return the arr instance whose torrent or download folder holds a path (longest prefix wins), or None.
+    """
+    if not path:
+        return None
+    path = os.path.normpath(path)
+    for folder, instance in arr_routes:
+        if path == folder or path.startswith(folder + os.sep):
+            return instance
+    return None
+
+
+def arrs_folders():
+    for instance in arr_instances:
+        if instance.enabled:
+            os.makedirs(instance.torrent_folder, exist_ok=True)
+            os.makedirs(instance.download_folder, exist_ok=True)
 
 
 def monitored_folders():
-    enabled = {
-        'sonarr' : sonarr_enabled,
-        'radarr' : radarr_enabled
-    }
+    """
+    Return the torrent folders of the enabled instances, leaving out folders inside another one.
+    Without ARR_INSTANCES the whole ARR_TORRENTS_PATH is monitored, as it always was.
+    """
+    if not arr_instance_names:
+        return [torrent_path]
+    folders = sorted({instance.torrent_folder for instance in arr_instances if instance.enabled}, key=len)
     monitored = []
-    for key, value in enabled.items():
-        if value:
-            monitored.append(os.path.join(torrent_path, key))
+    for folder in folders:
+        if not any(folder.startswith(parent + os.sep) for parent in monitored):
+            monitored.append(folder)
     return monitored
 
 def get_arr_folder(file_path):
     """
-    Determine if a .magnet file is in the Radarr or Sonarr folder.
+    Return the download folder of the arr instance a .magnet file was dropped for, or None.
     """
-    # Normalize the file path for comparison
+    instance = find_instance(file_path)
+    if instance is None:
+        return None
     file_path = os.path.normpath(file_path)
+    if file_path == instance.torrent_folder or file_path.startswith(instance.torrent_folder + os.sep):
+        return instance.download_folder
+    return None
 
-    # Check if the file is in the Radarr folder
-    if file_path.startswith(os.path.normpath(radarr_folder)):
-        radarr_downloads = os.path.join(download_path, 'radarr')
-        return radarr_downloads
-    # Check if the file is in the Sonarr folder
-    elif file_path.startswith(os.path.normpath(sonarr_folder)):
-        sonarr_downloads = os.path.join(download_path, 'sonarr')
-        return sonarr_downloads
-    else:
-        return None
 
+def search_and_mark_failed(release_title, file_path, infohash=None):
+    """
+    Queue a release to be marked as failed in its arr instance, followed by a search for a replacement.
+    file_path is the magnet/torrent file or the placeholder in the download folder, and picks the instance.
+    The infohash, when known, is used to find the release before falling back to its title.
+    Failures are sent in batches; see FailureBatcher.
+    """
+    instance = find_instance(file_path)
+    if instance is None:
+        print("Release is not from a configured Sonarr or Radarr instance.")
+        return False
+    print(f"Release is from {instance.name}.")
+    instance.report_failure(release_title, infohash)
+    return True
 
+def flush_failure_reports():
+    """
+    Send every queued failure now, e.g. before shutting down.
+    """
+    for instance in arr_instances:
+        instance.failures.flush()
 
-def search_and_mark_failed(release_title, file_path):
+def search_and_mark_failed_in_sonarr(instance, releases):
     """
-    Search for a release in Sonarr or Radarr's history and mark it as failed.
+    Mark a batch of (release title, infohash) releases as failed in a Sonarr instance's history,
+    then search for all of their episodes with a single EpisodeSearch command.
+    Returns {release title: whether it was marked}.
     """
-    # Determine if the release is from Sonarr or Radarr
-    if file_path.startswith(os.path.normpath(os.path.join(os.getenv('ARR_TORRENTS_PATH'), 'sonarr'))):
-        print("Release is from Sonarr.")
-        return search_and_mark_failed_in_sonarr(release_title)
-    elif file_path.startswith(os.path.normpath(os.path.join(os.getenv('ARR_TORRENTS_PATH'), 'radarr'))):
-        print("Release is from Radarr.")
-        return search_and_mark_failed_in_radarr(release_title)
-    else:
-        print("Release is not from Sonarr or Radarr.")
-        return False
+    headers = {"X-Api-Key": instance.api_key}
+    results = {}
+    marked = set()  # History record ids marked in this batch
+    episode_ids = []
+
+    for release_title, infohash in releases:
+        try:
+            # Steps 1-2: Find the release in Sonarr's grab history
+            release_found = instance.history.find(release_title, infohash)
+
+            if not release_found:
+                print(f"Release '{release_title}' not found in {instance.name} history.")
+                results[release_title] = False
+                continue
+            if release_found["id"] in marked:
+                results[release_title] = True  # Another drop of the same grab
+                continue
+
+            # Step 3: Mark the release as failed
+            mark_failed_url = f"{instance.base_url}/api/v3/history/failed/{release_found['id']}"
+            data = {
+                "id": release_found["id"],
+                "seriesId": release_found["seriesId"],
+                "sourceTitle": release_found["sourceTitle"],
+                "quality": release_found["quality"],
+                "customFormatScore": release_found["customFormatScore"],
+                "reason": "ManualFailure",  # Reason for marking as failed
+                "type": "manual"  # Type of failure
+            }
+
+            # Add episodeIds if the release has episodes
+            if "episodes" in release_found:
+                data["episodeIds"] = [episode["id"] for episode in release_found["episodes"]]
+
+            response = instance.history.session.post(mark_failed_url, headers=headers, json=data)
+            response.raise_for_status()
 
-def search_and_mark_failed_in_sonarr(release_title):
-    """
-    Search for a release in Sonarr's history and mark it as failed.
-    """
-    if not SONARR_API_KEY or not SONARR_BASE_URL:
-        raise ValueError("Sonarr API key or base URL is not set in the environment variables.")
-
-    # Step 1: Search for the release in Sonarr's history
-    history_url = f"{SONARR_BASE_URL}/api/v3/history"
-    headers = {"X-Api-Key": SONARR_API_KEY}
-    params = {"page": 1, "pageSize": 100, "sortKey": "date", "sortDirection": "descending", "eventType": 1}
-
-    try:
-        response = requests.get(history_url, headers=headers, params=params)
-        response.raise_for_status()
-        history = response.json()
-
-        # Step 2: Find the release in the history
-        release_found = None
-        for record in history["records"]:
-            if record["sourceTitle"] == release_title:
-                release_found = record
-                break
-
-        if not release_found:
-            print(f"Release '{release_title}' not found in Sonarr history.")
-            return False
-
-        # Step 3: Mark the release as failed
-        mark_failed_url = f"{SONARR_BASE_URL}/api/v3/history/failed/{release_found['id']}"
-        data = {
-            "id": release_found["id"],
-            "seriesId": release_found["seriesId"],
-            "sourceTitle": release_found["sourceTitle"],
-            "quality": release_found["quality"],
-            "customFormatScore": release_found["customFormatScore"],
-            "reason": "ManualFailure",  # Reason for marking as failed
-            "type": "manual"  # Type of failure
-        }
-
-        # Add episodeIds if the release has episodes
-        if "episodes" in release_found:
-            data["episodeIds"] = [episode["id"] for episode in release_found["episodes"]]
-
-        response = requests.post(mark_failed_url, headers=headers, json=data)
-        response.raise_for_status()
-
-        print(f"Release '{release_title}' marked as failed in Sonarr.")
-
-        # Step 4: Trigger a new search for the item if it has episodes
-        if "episodes" in release_found:
-            search_url = f"{SONARR_BASE_URL}/api/v3/command"
+            print(f"Release '{release_title}' marked as failed in {instance.name}.")
+            marked.add(release_found["id"])
+            results[release_title] = True
+            if "episodes" in release_found:
+                episode_ids.extend(episode["id"] for episode in release_found["episodes"])
+            else:
+                print(f"No episodes found for release '{release_title}'. Skipping search trigger.")
+
+        except requests.exceptions.RequestException as e:
+            print(f"Error interacting with {instance.name} API: {e}")
+            results[release_title] = False
+
+    # Step 4: Trigger one search for the episodes of every release in the batch
+    if episode_ids:
+        episode_ids = sorted(set(episode_ids))
+        try:
+            search_url = f"{instance.base_url}/api/v3/command"
             search_data = {
                 "name": "EpisodeSearch",
-                "episodeIds": [episode["id"] for episode in release_found["episodes"]]
+                "episodeIds": episode_ids
             }
 
-            response = requests.post(search_url, headers=headers, json=search_data)
+            response = instance.history.session.post(search_url, headers=headers, json=search_data)
             response.raise_for_status()
 
-            print(f"New search triggered for '{release_title}' in Sonarr.")
-        else:
-            print(f"No episodes found for release '{release_title}'. Skipping search trigger.")
+            print(f"New search triggered for {len(episode_ids)} episodes in {instance.name}.")
+        except requests.exceptions.RequestException as e:
+            print(f"Error interacting with {instance.name} API: {e}")
 
-        return True
+    return results
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error interacting with Sonarr API: {e}")
-        return False
-
-def search_and_mark_failed_in_radarr(release_title):
+def search_and_mark_failed_in_radarr(instance, releases):
     """
-    Search for a release in Radarr's history and mark it as failed.
+    Mark a batch of (release title, infohash) releases as failed in a Radarr instance's history,
+    then search for all of their movies with a single MoviesSearch command.
+    Returns {release title: whether it was marked}.
     """
-    if not RADARR_API_KEY or not RADARR_BASE_URL:
-        raise ValueError("Radarr API key or base URL is not set in the environment variables.")
-
-    # Step 1: Search for the release in Radarr's history
-    history_url = f"{RADARR_BASE_URL}/api/v3/history"
-    headers = {"X-Api-Key": RADARR_API_KEY}
-    params = {"page": 1, "pageSize": 100, "sortKey": "date", "sortDirection": "descending", "eventType": 1}
-
-    try:
-        response = requests.get(history_url, headers=headers, params=params)
-        response.raise_for_status()
-        history = response.json()
-
-        # Step 2: Find the release in the history
-        release_found = None
-        for record in history["records"]:
-            if record["sourceTitle"] == release_title:
-                release_found = record
-                break
-
-        if not release_found:
-            print(f"Release '{release_title}' not found in Radarr history.")
-            return False
+    headers = {"X-Api-Key": instance.api_key}
+    results = {}
+    marked = set()  # History record ids marked in this batch
+    movie_ids = []
+
+    for release_title, infohash in releases:
+        try:
+            # Steps 1-2: Find the release in Radarr's grab history
+            release_found = instance.history.find(release_title, infohash)
+
+            if not release_found:
+                print(f"Release '{release_title}' not found in {instance.name} history.")
+                results[release_title] = False
+                continue
+            if release_found["id"] in marked:
+                results[release_title] = True  # Another drop of the same grab
+                continue
+
+            # Step 3: Mark the release as failed
+            mark_failed_url = f"{instance.base_url}/api/v3/history/failed/{release_found['id']}"
+            data = {
+                "movieId": release_found["movieId"],
+                "sourceTitle": release_found["sourceTitle"],
+                "quality": release_found["quality"],
+                "customFormatScore": release_found["customFormatScore"],
+                "reason": "ManualFailure",  # Reason for marking as failed
+                "type": "manual"  # Type of failure
+            }
 
-        # Step 3: Mark the release as failed
-        mark_failed_url = f"{RADARR_BASE_URL}/api/v3/history/failed/{release_found['id']}"
-        data = {
-            "movieId": release_found["movieId"],
-            "sourceTitle": release_found["sourceTitle"],
-            "quality": release_found["quality"],
-            "customFormatScore": release_found["customFormatScore"],
-            "reason": "ManualFailure",  # Reason for marking as failed
-            "type": "manual"  # Type of failure
-        }
+            response = instance.history.session.post(mark_failed_url, headers=headers, json=data)
+            response.raise_for_status()
 
-        response = requests.post(mark_failed_url, headers=headers, json=data)
-        response.raise_for_status()
+            print(f"Release '{release_title}' marked as failed in {instance.name}.")
+            marked.add(release_found["id"])
+            results[release_title] = True
+            movie_ids.append(release_found["movieId"])
 
-        print(f"Release '{release_title}' marked as failed in Radarr.")
+        except requests.exceptions.RequestException as e:
+            print(f"Error interacting with {instance.name} API: {e}")
+            results[release_title] = False
 
-        search_url = f"{RADARR_BASE_URL}/api/v3/command"
-        search_data = {
-            "name": "MoviesSearch",
-            "movieIds": [release_found["movieId"]]
-        }
+    # Step 4: Trigger one search for the movies of every release in the batch
+    if movie_ids:
+        movie_ids = sorted(set(movie_ids))
+        try:
+            search_url = f"{instance.base_url}/api/v3/command"
+            search_data = {
+                "name": "MoviesSearch",
+                "movieIds": movie_ids
+            }
 
-        response = requests.post(search_url, headers=headers, json=search_data)
-        response.raise_for_status()
+            response = instance.history.session.post(search_url, headers=headers, json=search_data)
+            response.raise_for_status()
 
-        print(f"New search triggered for '{release_found['movieId']}' in Radarr.")
-        return True
+            print(f"New search triggered for movies {movie_ids} in {instance.name}.")
+        except requests.exceptions.RequestException as e:
+            print(f"Error interacting with {instance.name} API: {e}")
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error interacting with Radarr API: {e}")
-        return False
+    return results
 
-def create_locked_mkv_file(file_path):
+def create_locked_mkv_file(file_path, size=None):
     """
     Create a blank locked .mkv file at the specified path.
+    If the size of the real file is known, reserve that much disk space for it without
+    changing the blank file's size, so the import can fill it in place.
     """
-    try:
-        # Create the directory if it doesn't exist
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-        # Create a blank .mkv file
-        f = open(file_path, 'wb')
-        f.write(b'')  # Write an empty byte string to create the file
-
-        # Lock the file (platform-specific)
-        if os.name == 'posix':  # Linux/macOS
-            import fcntl
-            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        elif os.name == 'nt':  # Windows
-            import msvcrt
-            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
-
-        print(f"Created and locked blank .mkv file: {file_path}")
-    except Exception as e:
-        print(f"Failed to create or lock .mkv file: {e}")
-    finally:
-        # Close the file after locking
-        if 'f' in locals():
-            f.close()
+    with span("placeholder.create", file=os.path.basename(file_path), size=size):
+        try:
+            # Create the directory if it doesn't exist
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+            # Create a blank .mkv file
+            f = open(file_path, 'wb')
+            f.write(b'')  # Write an empty byte string to create the file
+            if preallocate(f.fileno(), size, keep_size=True):
+                print(f"Reserved {size} bytes for {file_path}")
+
+            # Lock the file (platform-specific)
+            if os.name == 'posix':  # Linux/macOS
+                import fcntl
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elif os.name == 'nt':  # Windows
+                import msvcrt
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+            print(f"Created and locked blank .mkv file: {file_path}")
+        except Exception as e:
+            print(f"Failed to create or lock .mkv file: {e}")
+        finally:
+            # Close the file after locking
+            if 'f' in locals():
+                f.close()
 
 def delete_blank_mkv_file(file_path):
     """
     Delete the blank locked .mkv file at the specified path.
     """
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"Deleted blank .mkv file: {file_path}")
-        else:
-            print(f"Blank .mkv file not found: {file_path}")
-    except Exception as e:
-        print(f"Failed to delete blank .mkv file: {e}")
+    with span("placeholder.delete", file=os.path.basename(file_path)):
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                print(f"Deleted blank .mkv file: {file_path}")
+            else:
+                print(f"Blank .mkv file not found: {file_path}")
+        except Exception as e:
+            print(f"Failed to delete blank .mkv file: {e}")
 
 
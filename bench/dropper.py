@@ -0,0 +1,31 @@
+import hashlib
+import os
+import time
+from urllib.parse import quote
+
+
+def make_release(index, seed=0):
+    """
+    Return (title, infohash, magnet link) for a reproducible fake release.
+    """
+    title = f"Bench.Show.S01E{index:04d}.1080p.WEB-DL-BENCH{seed}"
+    infohash = hashlib.sha1(f"{seed}:{title}".encode()).hexdigest()
+    return title, infohash, f"magnet:?xt=urn:btih:{infohash}&dn={quote(title)}"
+
+
+def drop_bursts(folder, releases, burst_size, burst_interval):
+    """
+    Write .magnet files for the releases into `folder`, `burst_size` at a time with
+    `burst_interval` seconds between bursts, the way an arr drops grabs.
+    Returns {title: drop time}.
+    """
+    os.makedirs(folder, exist_ok=True)
+    dropped = {}
+    for start in range(0, len(releases), burst_size):
+        if start:
+            time.sleep(burst_interval)
+        for title, _, magnet_link in releases[start:start + burst_size]:
+            with open(os.path.join(folder, f"{title}.magnet"), 'w') as f:
+                f.write(magnet_link)
+            dropped[title] = time.time()
+    return dropped
@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+
+from bench.fake_rd import serve
+
+
+class FakeArr:
+    """
+    In-memory stand-in for the Sonarr/Radarr history and command endpoints.
+
+    Releases are registered through POST /_releases (a JSON list of {sourceTitle, downloadId})
+    and show up as grab records in /api/v3/history, newest first.
+    """
+
+    def __init__(self, kind='sonarr', latency=0.0):
+        self.kind = kind
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.records = []  # Newest first
+        self.next_id = 1
+        self.failed = []  # History ids marked as failed
+        self.commands = []
+        self.calls = {}
+
+    def add_releases(self, releases):
+        with self.lock:
+            for release in releases:
+                record = {
+                    "id": self.next_id, "eventType": "grabbed", "date": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "sourceTitle": release["sourceTitle"], "downloadId": release.get("downloadId", "").upper(),
+                    "quality": {"quality": {"id": 7, "name": "WEBDL-1080p"}}, "customFormatScore": 0,
+                }
+                if self.kind == 'sonarr':
+                    record["seriesId"] = self.next_id
+                    record["episodes"] = [{"id": self.next_id * 100 + i} for i in range(release.get("episodes", 1))]
+                else:
+                    record["movieId"] = self.next_id
+                self.records.insert(0, record)
+                self.next_id += 1
+
+    def handle(self, method, path, query, body):
+        parts = [part for part in path.split('/') if part]
+        if parts[:1] == ['_stats']:
+            with self.lock:
+                return 200, {"calls": dict(self.calls), "failed": list(self.failed), "commands": list(self.commands)}
+        if parts[:1] == ['_releases']:
+            self.add_releases(json.loads(body or '[]'))
+            return 201, {}
+        # The blackhole appends /api/v3 to the base URL
+        if parts[:2] == ['api', 'v3']:
+            parts = parts[2:]
+        endpoint = '/'.join(parts[:2])
+        with self.lock:
+            self.calls[f"{method} {endpoint}"] = self.calls.get(f"{method} {endpoint}", 0) + 1
+        time.sleep(self.latency)
+
+        if method == 'GET' and parts == ['history']:
+            page = int(query.get('page', ['1'])[0])
+            page_size = int(query.get('pageSize', ['10'])[0])
+            with self.lock:
+                records = self.records[(page - 1) * page_size:page * page_size]
+                total = len(self.records)
+            return 200, {"page": page, "pageSize": page_size, "totalRecords": total, "records": records}
+        if method == 'POST' and endpoint == 'history/failed':
+            with self.lock:
+                self.failed.append(int(parts[2]))
+            return 200, {}
+        if method == 'POST' and parts == ['command']:
+            command = json.loads(body or '{}')
+            with self.lock:
+                self.commands.append(command)
+            return 201, {"id": len(self.commands), "name": command.get("name"), "status": "queued"}
+        return 404, {"message": "NotFound"}
+
+
+def run_forever(port, **kwargs):
+    """
+    Entry point for running a fake Sonarr/Radarr in its own process.
+    """
+    serve(FakeArr(**kwargs), port)
+    threading.Event().wait()
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+from html import escape
+from urllib.parse import quote, unquote
+
+from bench.fake_rd import serve
+
+
+class FakeMountAPI:
+    """
+    Base for the fake listing APIs. Listings are read from a real directory (root), so the
+    files the fake Real-Debrid puts on the synthetic mount show up through the API too.
+    """
+
+    def __init__(self, root, latency=0.0):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.base_url = None  # Set by serve()
+
+    def count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return 200, {"calls": dict(self.calls)}
+
+    def resolve(self, remote):
+        """
+        Return the directory of a remote path, or None if it isn't a directory under root.
+        """
+        path = os.path.normpath(os.path.join(self.root, remote.strip('/')))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            return None
+        return path if os.path.isdir(path) else None
+
+
+class FakeRcloneRC(FakeMountAPI):
+    """
+    Stand-in for the vfs/refresh and operations/list commands of rclone's remote control API.
+    The remote's root is `root`, so the rclone folder is a subfolder of it, like zurg's __all__.
+    """
+
+    def handle(self, method, path, query, body):
+        command = path.strip('/')
+        if command == '_stats':
+            return self.stats()
+        self.count(f"{method} {command}")
+        time.sleep(self.latency)
+        params = json.loads(body or '{}')
+        if method != 'POST':
+            return 405, {"error": "method not allowed", "status": 405}
+        if command == 'vfs/refresh':
+            remote = params.get("dir", "")
+            result = "OK" if self.resolve(remote) else "file does not exist"
+            return 200, {"result": {remote: result}}
+        if command == 'operations/list':
+            remote = params.get("remote", "")
+            folder = self.resolve(remote)
+            if folder is None:
+                return 404, {"error": "directory not found", "input": params, "path": command, "status": 404}
+            items = []
+            for entry in os.scandir(folder):
+                items.append({"Path": f"{remote.strip('/')}/{entry.name}", "Name": entry.name,
+                              "Size": -1 if entry.is_dir() else entry.stat().st_size, "IsDir": entry.is_dir()})
+            return 200, {"list": items}
+        return 404, {"error": "couldn't find method", "path": command, "status": 404}
+
+
+class FakeZurg(FakeMountAPI):
+    """
+    Stand-in for zurg's HTML directory listing at /http/<directory>/<torrent>/.
+    """
+
+    def handle(self, method, path, query, body):
+        parts = [unquote(part) for part in path.split('/') if part]
+        if parts[:1] == ['_stats']:
+            return self.stats()
+        self.count(f"{method} {'/'.join(parts[:1])}")
+        time.sleep(self.latency)
+        if method != 'GET' or parts[:1] != ['http']:
+            return 404, "404 page not found\n"
+        folder = self.resolve('/'.join(parts[1:]))
+        if folder is None:
+            return 404, "404 page not found\n"
+        prefix = '/' + '/'.join(quote(part) for part in parts) + '/'
+        links = ['<li><a href="../">../</a></li>']
+        for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+            suffix = '/' if entry.is_dir() else ''
+            links.append(f'<li><a href="{escape(prefix + quote(entry.name) + suffix)}">{escape(entry.name)}</a></li>')
+        return 200, "<html><body><ol>\n" + "\n".join(links) + "\n</ol></body></html>\n"
+
+
+FAKES = {
+    'rclone': FakeRcloneRC,
+    'zurg': FakeZurg,
+}
+
+
+def run_forever(port, kind, root, **kwargs):
+    """
+    Entry point for running a fake mount listing API in its own process.
+    """
+    serve(FAKES[kind](root, **kwargs), port)
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Fake rclone RC or zurg listing API server")
+    parser.add_argument('kind', choices=list(FAKES))
+    parser.add_argument('root', help="Directory served as the remote's root")
+    parser.add_argument('--port', type=int, default=5572)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    print(f"Fake {args.kind} listing {args.root} on http://127.0.0.1:{args.port}")
+    run_forever(args.port, args.kind, args.root, latency=args.latency)
@@ -0,0 +1,315 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def is_cached(infohash, cache_hit_ratio, seed=0):
+    """
+    Decide, reproducibly, whether the fake Real-Debrid has a torrent cached.
+    """
+    return random.Random(f"{seed}:{infohash.lower()}").random() < cache_hit_ratio
+
+
+def torrent_files(title, files_per_torrent):
+    """
+    Return the (path, is_video) files of a fake torrent. Every torrent also has a sample and an .nfo
+    so the video file filtering is exercised.
+    """
+    if files_per_torrent == 1:
+        files = [(f"/{title}.mkv", True)]
+    else:
+        files = [(f"/{title}/{title}.E{i:02}.mkv", True) for i in range(1, files_per_torrent + 1)]
+    return files + [(f"/{title}/sample.mkv", False), (f"/{title}/{title}.nfo", False)]
+
+
+def file_content(torrent_id, file_id, offset, length):
+    """
+    Return bytes [offset, offset + length) of a fake torrent file. The content is a
+    reproducible pattern, so ranged downloads can be checked byte for byte.
+    """
+    block = hashlib.sha256(f"{torrent_id}:{file_id}".encode()).digest() * 128  # 4 KiB
+    start = offset % len(block)
+    repeated = block * (-(-(start + length) // len(block)))
+    return repeated[start:start + length]
+
+
+class FakeRealDebrid:
+    """
+    In-memory stand-in for the parts of the Real-Debrid API the blackhole uses.
+
+    Every request is delayed by `latency` seconds. A torrent is cached with probability
+    `cache_hit_ratio`; cached torrents finish downloading `download_time` seconds after
+    their files are selected and show up under `mount_root` (like zurg's __all__ folder)
+    `mount_delay` seconds after that. Unrestricted links are served from /_download with
+    HTTP Range support, for direct downloads.
+    """
+
+    def __init__(self, mount_root=None, latency=0.0, cache_hit_ratio=1.0, download_time=0.0, mount_delay=0.0,
+                 files_per_torrent=1, file_size=1024 * 1024, seed=0):
+        self.mount_root = mount_root
+        self.latency = latency
+        self.cache_hit_ratio = cache_hit_ratio
+        self.download_time = download_time
+        self.mount_delay = mount_delay
+        self.files_per_torrent = files_per_torrent
+        self.file_size = file_size
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.torrents = {}  # id -> torrent
+        self.calls = {}  # endpoint -> count
+        self.base_url = None  # Set by serve()
+
+    def count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def handle(self, method, path, query, body):
+        """
+        Handle one API call and return (status, body) or (status, body, headers).
+        """
+        form = parse_qs(body or '')
+        parts = [part for part in path.split('/') if part]
+        if parts[:1] == ['_stats']:
+            with self.lock:
+                return 200, {"calls": dict(self.calls), "torrents": len(self.torrents)}
+        # Strip the /rest/1.0 prefix if the client was pointed at it
+        if parts[:2] == ['rest', '1.0']:
+            parts = parts[2:]
+        endpoint = '/'.join(parts[:2])
+        self.count(f"{method} {endpoint}")
+        time.sleep(self.latency)
+
+        if method == 'POST' and endpoint == 'torrents/addMagnet':
+            return self.add_magnet(form.get('magnet', [''])[0])
+        if method == 'GET' and endpoint == 'torrents/info':
+            return self.info(parts[2])
+        if method == 'POST' and endpoint == 'torrents/selectFiles':
+            return self.select_files(parts[2], form.get('files', [''])[0])
+        if method == 'DELETE' and endpoint == 'torrents/delete':
+            with self.lock:
+                return (204, None) if self.torrents.pop(parts[2], None) else (404, {"error": "unknown_ressource"})
+        if method == 'GET' and endpoint == 'torrents/instantAvailability':
+            return 200, {h: ({"rd": [{"1": {"filename": "x.mkv", "filesize": self.file_size}}]}
+                             if is_cached(h, self.cache_hit_ratio, self.seed) else []) for h in parts[2:]}
+        if method == 'GET' and parts == ['torrents']:
+            return self.list_torrents(query)
+        if method == 'POST' and endpoint == 'unrestrict/link':
+            return self.unrestrict(form.get('link', [''])[0])
+        return 404, {"error": "unknown_ressource", "error_code": 7}
+
+    def add_magnet(self, magnet):
+        query = parse_qs(urlparse(magnet).query)
+        xt = query.get('xt', [''])[0]
+        if not xt.lower().startswith('urn:btih:'):
+            return 400, {"error": "parameter_invalid", "error_code": 2}
+        infohash = xt[len('urn:btih:'):].lower()
+        title = query.get('dn', [infohash])[0]
+        torrent_id = uuid.uuid4().hex[:13].upper()
+        files = [{"id": i, "path": path, "bytes": self.file_size, "selected": 0, "video": video}
+                 for i, (path, video) in enumerate(torrent_files(title, self.files_per_torrent), start=1)]
+        with self.lock:
+            self.torrents[torrent_id] = {
+                "id": torrent_id, "filename": title, "hash": infohash, "status": "waiting_files_selection",
+                "files": files, "added": time.time(), "selected_at": None,
+                "cached": is_cached(infohash, self.cache_hit_ratio, self.seed),
+            }
+        return 201, {"id": torrent_id, "uri": f"/torrents/info/{torrent_id}"}
+
+    def _status(self, torrent):
+        # Expects self.lock to be held
+        if torrent["selected_at"] is None:
+            return "waiting_files_selection", 0
+        if not torrent["cached"]:
+            return "queued", 0
+        elapsed = time.time() - torrent["selected_at"]
+        if elapsed < self.download_time:
+            return "downloading", int(100 * elapsed / self.download_time)
+        return "downloaded", 100
+
+    def _view(self, torrent):
+        # Expects self.lock to be held
+        status, progress = self._status(torrent)
+        selected = [f for f in torrent["files"] if f["selected"]]
+        return {
+            "id": torrent["id"], "filename": torrent["filename"], "hash": torrent["hash"],
+            "bytes": sum(f["bytes"] for f in selected), "status": status, "progress": progress,
+            "speed": int(sum(f["bytes"] for f in selected) / self.download_time) if status == "downloading" else 0,
+            "added": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(torrent["added"])),
+            "links": [f"https://real-debrid.com/d/{torrent['id']}{f['id']}" for f in selected] if progress == 100 else [],
+            "files": [{"id": f["id"], "path": f["path"], "bytes": f["bytes"], "selected": f["selected"]}
+                      for f in torrent["files"]],
+        }
+
+    def info(self, torrent_id):
+        with self.lock:
+            torrent = self.torrents.get(torrent_id)
+            if not torrent:
+                return 404, {"error": "unknown_ressource", "error_code": 7}
+            return 200, self._view(torrent)
+
+    def select_files(self, torrent_id, file_ids):
+        with self.lock:
+            torrent = self.torrents.get(torrent_id)
+            if not torrent:
+                return 404, {"error": "unknown_ressource", "error_code": 7}
+            wanted = set(file_ids.split(','))
+            for f in torrent["files"]:
+                f["selected"] = int(file_ids == 'all' or str(f["id"]) in wanted)
+            torrent["selected_at"] = time.time()
+            cached = torrent["cached"]
+        if cached and self.mount_root:
+            threading.Timer(self.download_time + self.mount_delay, self.materialize, (torrent_id,)).start()
+        return 204, None
+
+    def materialize(self, torrent_id):
+        """
+        Create the selected files of a downloaded torrent on the fake mount, the way zurg exposes them.
+        """
+        with self.lock:
+            torrent = self.torrents.get(torrent_id)
+            if not torrent:
+                return
+            folder = os.path.join(self.mount_root, torrent["filename"])
+            paths = [os.path.join(folder, os.path.basename(f["path"])) for f in torrent["files"] if f["selected"]]
+        os.makedirs(folder, exist_ok=True)
+        for path in paths:
+            with open(path, 'wb') as f:
+                f.truncate(self.file_size)
+
+    def unrestrict(self, link):
+        with self.lock:
+            for torrent in self.torrents.values():
+                for f in torrent["files"]:
+                    if f["selected"] and link == f"https://real-debrid.com/d/{torrent['id']}{f['id']}":
+                        return 200, {"id": f"{torrent['id']}{f['id']}", "filename": os.path.basename(f["path"]),
+                                     "filesize": f["bytes"],
+                                     "download": f"{self.base_url}/_download/{torrent['id']}/{f['id']}"}
+        return 503, {"error": "unavailable_file", "error_code": 19}
+
+    def download(self, torrent_id, file_id):
+        """
+        Return (file id, size) of a file that can be downloaded, or None.
+        """
+        with self.lock:
+            torrent = self.torrents.get(torrent_id)
+            for f in torrent["files"] if torrent else []:
+                if str(f["id"]) == file_id and f["selected"]:
+                    return f["id"], f["bytes"]
+        return None
+
+    def list_torrents(self, query):
+        page = int(query.get('page', ['1'])[0])
+        limit = int(query.get('limit', ['100'])[0])
+        with self.lock:
+            torrents = sorted(self.torrents.values(), key=lambda t: t["added"], reverse=True)
+            views = [self._view(t) for t in torrents[(page - 1) * limit:page * limit]]
+            total = len(torrents)
+        for view in views:
+            del view["files"]
+        return 200, views, {"X-Total-Count": str(total)}
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API and download servers
+
+    def _download(self, torrent_id, file_id):
+        """
+        Serve a file of a fake torrent, honouring a single-range Range header.
+        """
+        self.server.fake.count('GET _download')
+        found = self.server.fake.download(torrent_id, file_id)
+        if not found:
+            self.send_error(404)
+            return
+        _, size = found
+        start, end, status = 0, size - 1, 200
+        header = self.headers.get('Range')
+        if header and header.startswith('bytes='):
+            first, _, last = header[len('bytes='):].partition('-')
+            start, end, status = int(first), min(int(last) if last else size - 1, size - 1), 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        offset = start
+        while offset <= end:
+            length = min(256 * 1024, end + 1 - offset)
+            self.wfile.write(file_content(torrent_id, file_id, offset, length))
+            offset += length
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if method == 'GET' and parts[:1] == ['_download'] and len(parts) == 3:
+            self._download(parts[1], parts[2])
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        request_body = self.rfile.read(length).decode() if length else None
+        status, body, *headers = self.server.fake.handle(method, url.path, parse_qs(url.query), request_body)
+        if isinstance(body, str):  # HTML listings, e.g. the fake zurg
+            payload, content_type = body.encode(), 'text/html; charset=utf-8'
+        else:
+            payload, content_type = json.dumps(body).encode() if body is not None else b'', 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers[0] if headers else {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(fake, port=0, host='127.0.0.1'):
+    """
+    Serve a fake API object on a background thread and return the server.
+    """
+    server = ThreadingHTTPServer((host, port), FakeRequestHandler)
+    server.daemon_threads = True
+    server.fake = fake
+    fake.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_forever(port, **kwargs):
+    """
+    Entry point for running the fake Real-Debrid API in its own process.
+    """
+    serve(FakeRealDebrid(**kwargs), port)
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Fake Real-Debrid API server")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--mount-root')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--cache-hit-ratio', type=float, default=1.0)
+    parser.add_argument('--download-time', type=float, default=0.0)
+    parser.add_argument('--mount-delay', type=float, default=0.0)
+    args = parser.parse_args()
+    print(f"Fake Real-Debrid listening on http://127.0.0.1:{args.port}")
+    run_forever(args.port, mount_root=args.mount_root, latency=args.latency, cache_hit_ratio=args.cache_hit_ratio,
+                download_time=args.download_time, mount_delay=args.mount_delay)
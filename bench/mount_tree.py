@@ -0,0 +1,35 @@
+import os
+
+
+def generate_mount_tree(root, file_count, files_per_folder=10, file_size=0):
+    """
+    Fill `root` with a synthetic zurg-style library: one folder per torrent with
+    `files_per_folder` episodes each, `file_count` files in total.
+    An existing tree with the same file count is reused, so large trees are only built once.
+    """
+    marker = os.path.join(root, '.bench_tree')
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if f.read().strip() == f"{file_count}:{files_per_folder}:{file_size}":
+                return
+    os.makedirs(root, exist_ok=True)
+    for index in range(0, file_count, files_per_folder):
+        folder = os.path.join(root, f"Library.Show.{index // files_per_folder:06d}.1080p.WEB-DL")
+        os.makedirs(folder, exist_ok=True)
+        for episode in range(1, min(files_per_folder, file_count - index) + 1):
+            path = os.path.join(folder, f"Library.Show.{index // files_per_folder:06d}.E{episode:02d}.mkv")
+            with open(path, 'wb') as f:
+                if file_size:
+                    f.truncate(file_size)
+    with open(marker, 'w') as f:
+        f.write(f"{file_count}:{files_per_folder}:{file_size}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate a synthetic rclone/zurg mount tree")
+    parser.add_argument('root')
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--files-per-folder', type=int, default=10)
+    args = parser.parse_args()
+    generate_mount_tree(args.root, args.files, args.files_per_folder)
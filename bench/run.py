@@ -0,0 +1,233 @@
+"""
+End-to-end benchmark of the blackhole against local fakes.
+
+Starts a fake Real-Debrid and a fake Sonarr in their own processes, generates a synthetic
+zurg mount, then runs the real MagnetFileHandler and RcloneFileHandler while magnets are
+dropped in bursts. With --mount-watcher rclone or zurg, the mount is listed through a fake
+rclone RC or zurg API (bench/fake_mount_api.py). Results are printed as JSON (and written to
+--output) so runs can be compared for regressions.
+
+    python -m bench.run --magnets 100 --burst-size 20 --mount-files 50000 --output bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from bench import fake_arr, fake_mount_api, fake_rd
+from bench.dropper import make_release, drop_bursts
+from bench.mount_tree import generate_mount_tree
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Fake server on port {port} did not start")
+
+
+def fetch_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stats") as response:
+        return json.load(response)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the blackhole end to end against local fakes")
+    parser.add_argument('--magnets', type=int, default=50, help="Number of magnets to drop")
+    parser.add_argument('--burst-size', type=int, default=10, help="Magnets dropped per burst")
+    parser.add_argument('--burst-interval', type=float, default=5, help="Seconds between bursts")
+    parser.add_argument('--files-per-torrent', type=int, default=1, help="Video files per torrent")
+    parser.add_argument('--file-size', type=int, default=1024 * 1024, help="Size in bytes of each video file")
+    parser.add_argument('--mount-files', type=int, default=10000, help="Files in the synthetic mount")
+    parser.add_argument('--cache-hit-ratio', type=float, default=0.9)
+    parser.add_argument('--rd-latency', type=float, default=0.05, help="Seconds added to every RD API call")
+    parser.add_argument('--arr-latency', type=float, default=0.02, help="Seconds added to every arr API call")
+    parser.add_argument('--download-time', type=float, default=0, help="Seconds a cached torrent spends downloading")
+    parser.add_argument('--mount-delay', type=float, default=2, help="Seconds before a downloaded torrent is on the mount")
+    parser.add_argument('--direct', action='store_true',
+                        help="Download files from the fake RD's unrestricted links instead of copying from the mount")
+    parser.add_argument('--mount-watcher', choices=['targeted', 'rclone', 'zurg', 'poll'], default='targeted',
+                        help="MOUNT_WATCHER to run; rclone and zurg list the mount through a fake API")
+    parser.add_argument('--trace', action='store_true',
+                        help="Trace the run and export a Chrome trace-event file to the workdir")
+    parser.add_argument('--timeout', type=float, default=900, help="Give up after this many seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help="Directory for the mount and arr folders (default: a temporary directory)")
+    parser.add_argument('--output', help="Also write the JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The blackhole logs with print(); keep stdout for the JSON results
+    results_stream, sys.stdout = sys.stdout, sys.stderr
+    workdir = args.workdir or tempfile.mkdtemp(prefix='blackhole-bench-')
+    torrents_path = os.path.join(workdir, 'torrents')
+    download_path = os.path.join(workdir, 'downloads')
+    mount_path = os.path.join(workdir, 'mount')
+    magnet_folder = os.path.join(torrents_path, 'sonarr')
+    for folder in (magnet_folder, os.path.join(download_path, 'sonarr'), mount_path):
+        os.makedirs(folder, exist_ok=True)
+    job_db = os.path.join(workdir, f'jobs-{os.getpid()}.db')
+
+    # Start the fakes in their own processes so they don't compete for this process's GIL
+    rd_port, arr_port = free_port(), free_port()
+    fakes = [
+        multiprocessing.Process(target=fake_rd.run_forever, args=(rd_port,), daemon=True, kwargs=dict(
+            mount_root=mount_path, latency=args.rd_latency, cache_hit_ratio=args.cache_hit_ratio,
+            download_time=args.download_time, mount_delay=args.mount_delay,
+            files_per_torrent=args.files_per_torrent, file_size=args.file_size, seed=args.seed)),
+        multiprocessing.Process(target=fake_arr.run_forever, args=(arr_port,), daemon=True,
+                                kwargs=dict(kind='sonarr', latency=args.arr_latency)),
+    ]
+    mount_api_port = None
+    if args.mount_watcher in fake_mount_api.FAKES:
+        # The fake API's remote is the workdir, so the mount is its 'mount' folder, like zurg's __all__
+        mount_api_port = free_port()
+        fakes.append(multiprocessing.Process(target=fake_mount_api.run_forever, daemon=True,
+                                             args=(mount_api_port, args.mount_watcher, workdir)))
+    for fake in fakes:
+        fake.start()
+    for port in (rd_port, arr_port, mount_api_port):
+        if port:
+            wait_for_port(port)
+
+    print(f"Generating a mount tree with {args.mount_files} files...", file=sys.stderr)
+    generate_mount_tree(os.path.join(mount_path, 'library'), args.mount_files)
+
+    # The blackhole modules read their configuration from the environment on import
+    os.environ.update({
+        'RD_APITOKEN': 'bench', 'RD_BASE_URL': f"http://127.0.0.1:{rd_port}",
+        'ARR_TORRENTS_PATH': torrents_path, 'ARR_DOWNLOAD_PATH': download_path, 'RCLONE_PATH': mount_path,
+        'SONARR': 'True', 'SONARR_BASE_URL': f"http://127.0.0.1:{arr_port}", 'SONARR_API': 'bench',
+        'JOB_DB_PATH': job_db, 'MOUNT_RESYNC_INTERVAL': str(24 * 60 * 60),
+        'DIRECT_DOWNLOAD': 'sonarr' if args.direct else '',
+        'MOUNT_WATCHER': args.mount_watcher, 'RCLONE_RC_URL': f"http://127.0.0.1:{mount_api_port}",
+        'ZURG_URL': f"http://127.0.0.1:{mount_api_port}", 'ZURG_DIRECTORY': os.path.basename(mount_path),
+        'TRACE_FILE': os.path.join(workdir, 'trace.jsonl') if args.trace else '',
+    })
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from watchdog.observers import Observer
+    from jobs import JobStore, DONE
+    from monitor import MagnetFileHandler, RcloneFileHandler
+    from real_debrid import rd_client
+    from tracing import start_tracing, stop_tracing, export_chrome_trace, trace_file
+    start_tracing()
+
+    releases = [make_release(i, args.seed) for i in range(args.magnets)]
+    expected_files = {}  # video file name -> title, for releases that are cached
+    for title, infohash, _ in releases:
+        if fake_rd.is_cached(infohash, args.cache_hit_ratio, args.seed):
+            for path, video in fake_rd.torrent_files(title, args.files_per_torrent):
+                if video:
+                    expected_files[os.path.basename(path)] = title
+    expected_failures = sum(1 for _, h, _ in releases if not fake_rd.is_cached(h, args.cache_hit_ratio, args.seed))
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{arr_port}/_releases", method='POST',
+        data=json.dumps([{"sourceTitle": title, "downloadId": infohash, "episodes": args.files_per_torrent}
+                         for title, infohash, _ in releases]).encode())
+    urllib.request.urlopen(request).close()
+
+    started = time.time()
+    job_store = JobStore(job_db)
+    rclone_handler = RcloneFileHandler(mount_path, job_store)
+    magnet_handler = MagnetFileHandler(torrents_path, job_store, on_jobs_queued=rclone_handler.schedule_torrent)
+    rclone_thread = threading.Thread(target=rclone_handler.start_processing, daemon=True)
+    rclone_thread.start()
+    magnet_observer = Observer()
+    rclone_observer = rclone_handler.mount_source
+    magnet_observer.schedule(magnet_handler, torrents_path, recursive=True)
+    magnet_observer.start()
+    rclone_observer.start()
+    magnet_handler.start_reconciliation()
+    rclone_handler.mount_index.wait_ready()
+    ready = time.time()
+
+    dropped = drop_bursts(magnet_folder, releases, args.burst_size, args.burst_interval)
+
+    imported = {}  # title -> time its last file was imported
+    failures = 0
+    done = []
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        done = [job for job in job_store.jobs_in_state(DONE) if os.path.basename(job['filename']) in expected_files]
+        failures = len(fetch_stats(arr_port)["failed"])
+        if len(done) >= len(expected_files) and failures >= expected_failures:
+            break
+        time.sleep(0.5)
+    for job in done:
+        title = expected_files[os.path.basename(job['filename'])]
+        imported[title] = max(imported.get(title, 0), job['updated'])
+
+    magnet_observer.stop()
+    rclone_observer.stop()
+    magnet_handler.stop_processing()
+    rclone_handler.stop_processing()
+    job_store.close()
+    stop_tracing()
+    trace_path = os.path.join(workdir, 'trace.json') if args.trace else None
+    if trace_path:
+        export_chrome_trace([trace_file], trace_path)
+
+    latencies = [imported[title] - dropped[title] for title in imported]
+    rd_calls = sum(fetch_stats(rd_port)["calls"].values())
+    arr_calls = sum(fetch_stats(arr_port)["calls"].values())
+    span = (max(imported.values()) - min(dropped.values())) if imported else None
+    results = {
+        "config": vars(args),
+        "results": {
+            "startup_seconds": ready - started,
+            "imports_expected": len(set(expected_files.values())),
+            "imports_completed": len(imported),
+            "failures_expected": expected_failures,
+            "failures_reported": failures,
+            "timed_out": len(imported) < len(set(expected_files.values())) or failures < expected_failures,
+            "magnets_per_minute": len(imported) / span * 60 if span else None,
+            "drop_to_import_p50_seconds": percentile(latencies, 50),
+            "drop_to_import_p99_seconds": percentile(latencies, 99),
+            "rd_api_calls": rd_calls,
+            "rd_api_calls_per_import": rd_calls / len(imported) if imported else None,
+            "arr_api_calls": arr_calls,
+            "arr_search_commands": len(fetch_stats(arr_port)["commands"]),
+            "mount_api_calls": sum(fetch_stats(mount_api_port)["calls"].values()) if mount_api_port else None,
+            "rd_client_latency": rd_client.stats(),
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "trace": trace_path,
+        },
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output, file=results_stream)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    for fake in fakes:
+        fake.terminate()
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from metrics import COPIES_QUEUED, COPIES_ACTIVE
+
+load_dotenv()
+copy_slots = int(os.getenv('COPY_SLOTS', 2))
+copy_bandwidth_limit = float(os.getenv('COPY_BANDWIDTH_LIMIT', 0)) * 1024 * 1024
+copy_destination_bandwidth_limit = float(os.getenv('COPY_DESTINATION_BANDWIDTH_LIMIT', 0)) * 1024 * 1024
+copy_order = os.getenv('COPY_ORDER', 'smallest').lower()
+
+# 'smallest' copies small files first so episodes aren't stuck behind season packs and remuxes,
+# 'oldest' copies in the order the jobs were created
+COPY_ORDERS = ('smallest', 'oldest')
+
+
+class BandwidthLimiter:
+    """
+    Thread-safe token bucket over bytes per second. A copy may overdraw it by one block and
+    then sleeps off the debt, so large blocks still average out to the rate.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        """
+        Take n bytes from the bucket, sleeping until they are paid for.
+        """
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait_time:
+            time.sleep(wait_time)
+
+
+class CopyScheduler:
+    """
+    Runs imports on a fixed number of copy slots.
+
+    Queued copies are started smallest first or oldest first (see COPY_ORDER). Every block
+    copied is charged to a global bandwidth limit and to one for its destination, so
+    imports don't starve Plex streaming from the same mount.
+    """
+
+    def __init__(self, slots=copy_slots, bandwidth_limit=copy_bandwidth_limit,
+                 destination_bandwidth_limit=copy_destination_bandwidth_limit, order=copy_order):
+        if order not in COPY_ORDERS:
+            raise ValueError(f"Unknown copy order '{order}'. Expected one of: {', '.join(COPY_ORDERS)}.")
+        self.order = order
+        self.limiter = BandwidthLimiter(bandwidth_limit)
+        self.destination_bandwidth_limit = destination_bandwidth_limit
+        self.destination_limiters = {}  # destination -> BandwidthLimiter
+        self.heap = []  # (priority, seq, destination, function)
+        self.counter = itertools.count()
+        self.active = 0
+        self.condition = threading.Condition()
+        self.running = True
+        COPIES_QUEUED.set_function(lambda: len(self.heap))
+        COPIES_ACTIVE.set_function(lambda: self.active)
+        self.workers = [threading.Thread(target=self._worker, name=f'copy-{i}', daemon=True)
+                        for i in range(max(1, slots))]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, function, destination, size=None, created=None):
+        """
+        Queue function(throttle) to run on a copy slot. throttle(n) must be called with the
+        number of bytes after each block is copied. size (bytes) and created (timestamp)
+        order the queue.
+        """
+        if self.order == 'smallest':
+            priority = (size if size is not None else float('inf'), created or 0)
+        else:
+            priority = (created or 0, size or 0)
+        with self.condition:
+            heapq.heappush(self.heap, (priority, next(self.counter), destination, function))
+            self.condition.notify()
+
+    def throttle(self, destination):
+        """
+        Return a callable that charges copied bytes to the global and the destination's limits.
+        """
+        with self.condition:
+            limiter = self.destination_limiters.get(destination)
+            if limiter is None:
+                limiter = BandwidthLimiter(self.destination_bandwidth_limit)
+                self.destination_limiters[destination] = limiter
+
+        def consume(n):
+            self.limiter.consume(n)
+            limiter.consume(n)
+        return consume
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while self.running and not self.heap:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                _, _, destination, function = heapq.heappop(self.heap)
+                self.active += 1
+            try:
+                function(self.throttle(destination))
+            except Exception as e:
+                print(f"Error running copy to {destination}: {e}")
+            finally:
+                with self.condition:
+                    self.active -= 1
+
+    def __len__(self):
+        with self.condition:
+            return len(self.heap) + self.active
+
+    def stop(self):
+        """
+        Stop starting queued copies. Copies already running are left to finish.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
@@ -0,0 +1,225 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from dotenv import load_dotenv
+import requests
+from requests.adapters import HTTPAdapter
+from arrs import find_instance
+from download import preallocate, verify_copy, check_size
+from metrics import COPY_SECONDS, COPY_BYTES, COPY_THROUGHPUT
+
+load_dotenv()
+direct_download_arrs = {name.strip().lower() for name in os.getenv('DIRECT_DOWNLOAD', '').split(',') if name.strip()}
+direct_download_segments = int(os.getenv('DIRECT_DOWNLOAD_SEGMENTS', 8))
+direct_download_min_segment = int(os.getenv('DIRECT_DOWNLOAD_MIN_SEGMENT', 32 * 1024 * 1024))
+direct_download_retries = int(os.getenv('DIRECT_DOWNLOAD_RETRIES', 5))
+
+CHUNK_SIZE = 1024 * 1024  # Bytes read from the response per pwrite
+STATE_SAVE_INTERVAL = 2  # Seconds between saves of the segment progress
+
+
+class DownloadError(Exception):
+    """
+    A download that can't be completed, e.g. because the server ignores Range requests.
+    """
+
+
+def uses_direct_download(arr_folder):
+    """
+    Return whether files for the arr instance of this folder are downloaded from Real-Debrid
+    instead of copied from the rclone mount (see DIRECT_DOWNLOAD).
+    """
+    instance = find_instance(arr_folder)
+    return instance is not None and instance.name.lower() in direct_download_arrs
+
+
+def plan_segments(size, segments=direct_download_segments, min_segment=direct_download_min_segment):
+    """
+    Split a file into up to `segments` [start, end, done] byte ranges (end inclusive) of at least min_segment bytes.
+    """
+    count = max(1, min(segments, size // max(1, min_segment)))
+    step = -(-size // count)
+    return [[start, min(size, start + step) - 1, 0] for start in range(0, size, step)]
+
+
+class SegmentedDownload:
+    """
+    Download one file with parallel HTTP Range requests, each writing its bytes with pwrite
+    straight to their offset in a file pre-sized to the download.
+
+    Progress of every segment is saved next to the file, so an interrupted download
+    resumes each segment where it stopped instead of starting over.
+    """
+
+    def __init__(self, session, url, path, size, segments=direct_download_segments,
+                 max_retries=direct_download_retries, throttle=None, timeout=30):
+        self.session = session
+        self.url = url
+        self.path = path
+        self.size = size
+        self.max_retries = max_retries
+        self.throttle = throttle
+        self.timeout = timeout
+        self.state_path = f"{path}.segments"
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()  # Set when a segment failed, so the others stop early
+        self.segments = self._load_state() or plan_segments(size, segments)
+
+    def _load_state(self):
+        """
+        Return the saved segments of an earlier attempt at the same file, or None.
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("size") != self.size or os.path.getsize(self.path) != self.size:
+            return None
+        return state["segments"]
+
+    def _save_state(self):
+        with self.lock:
+            state = {"size": self.size, "segments": [list(segment) for segment in self.segments]}
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+    def downloaded(self):
+        with self.lock:
+            return sum(done for _, _, done in self.segments)
+
+    def _download_segment(self, fd, segment):
+        """
+        Fetch one segment, resuming after its last written byte and retrying with backoff.
+        A response that writes nothing counts as a failed attempt. Returns early, leaving the
+        progress for the next attempt, once another segment has failed.
+        """
+        start, end, _ = segment
+        attempt = 0
+        while start + segment[2] <= end and not self.stopped.is_set():
+            offset = first = start + segment[2]
+            try:
+                with self.session.get(self.url, headers={"Range": f"bytes={offset}-{end}"}, stream=True,
+                                      timeout=self.timeout) as response:
+                    if response.status_code != 206:
+                        raise DownloadError(f"Expected a partial response for bytes {offset}-{end}, "
+                                            f"got {response.status_code}")
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        chunk = chunk[:end + 1 - offset]
+                        if not chunk:
+                            break
+                        written = 0
+                        while written < len(chunk):
+                            written += os.pwrite(fd, chunk[written:], offset + written)
+                        offset += len(chunk)
+                        with self.lock:
+                            segment[2] = offset - start
+                        if self.throttle:
+                            self.throttle(len(chunk))
+                        attempt = 0
+                        if self.stopped.is_set():
+                            return
+                if offset == first:
+                    raise DownloadError(f"Got no data for bytes {first}-{end}")
+            except (requests.exceptions.RequestException, DownloadError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = random.uniform(0, min(30, 2 ** attempt))
+                print(f"Segment {start}-{end} of {self.path} failed ({e}). Retrying in {delay:.1f} seconds...")
+                self.stopped.wait(delay)
+
+    def run(self):
+        """
+        Download every unfinished segment in parallel. Raises on failure, leaving the
+        progress saved for the next attempt.
+        """
+        mode = 'r+b' if os.path.exists(self.path) else 'wb'
+        with open(self.path, mode, buffering=0) as f:
+            preallocate(f.fileno(), self.size)
+            os.ftruncate(f.fileno(), self.size)
+            pending = [segment for segment in self.segments if segment[0] + segment[2] <= segment[1]]
+            if not pending:
+                return
+            with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix='segment') as executor:
+                futures = [executor.submit(self._download_segment, f.fileno(), segment) for segment in pending]
+                try:
+                    not_done = futures
+                    while not_done:
+                        done, not_done = wait(not_done, STATE_SAVE_INTERVAL, FIRST_EXCEPTION)
+                        if any(future.exception() for future in done):
+                            break
+                        self._save_state()
+                finally:
+                    # After a failure, stop the other segments and wait for them to save their progress
+                    self.stopped.set()
+                    wait(futures)
+                    self._save_state()
+                for future in futures:
+                    future.result()
+            os.fsync(f.fileno())
+
+
+def create_session(pool_size=direct_download_segments * 2):
+    """
+    Return a keep-alive session for downloads, with enough pooled connections for every segment.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+session = create_session()
+
+
+def download_file(url, dst, size, expected_size=None, segments=direct_download_segments, throttle=None,
+                  verify='size'):
+    """
+    Download a file from an unrestricted Real-Debrid link into dst.
+
+    The file is built under a hidden temporary name next to dst, in the space preallocated
+    for the blank placeholder if there is one, and renamed into place once complete.
+    An interrupted download is resumed from its saved segments on the next call.
+    Segments arrive out of order, so downloads are only size checked, never checksummed.
+    A link that isn't expected_size bytes (the size Real-Debrid reported for the torrent file)
+    raises SizeMismatchError before anything is downloaded.
+    """
+    if verify != 'none':
+        check_size(url, size, expected_size)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.partial")
+    placeholder = not os.path.exists(tmp) and os.path.isfile(dst) and not os.path.islink(dst) \
+        and os.path.getsize(dst) == 0
+    if placeholder:
+        os.replace(dst, tmp)
+
+    download = SegmentedDownload(session, url, tmp, size, segments, throttle=throttle)
+    start = time.monotonic()
+    try:
+        download.run()
+        if verify != 'none':
+            verify_copy(url, tmp, size, download.downloaded(), tail=0)
+    except BaseException:
+        if not os.path.lexists(dst):
+            # Put a blank placeholder back while the partial download waits to be resumed
+            with open(dst, 'wb'):
+                pass
+        raise
+    os.replace(tmp, dst)
+    if os.path.exists(download.state_path):
+        os.remove(download.state_path)
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    COPY_SECONDS.observe(elapsed)
+    COPY_BYTES.inc(amount=size)
+    COPY_THROUGHPUT.observe(size / elapsed)
+    print(f"Downloaded {dst} ({size / elapsed / (1024 * 1024):.1f} MB/s over {len(download.segments)} segments)")
@@ -1,23 +1,330 @@
+import ctypes
+import ctypes.util
+import errno
 import os
+import sys
+import zlib
 
 from dotenv import load_dotenv
 from tqdm import tqdm
 import time
+from metrics import COPY_SECONDS, COPY_BYTES, COPY_THROUGHPUT, COPY_VERIFY_FAILURES
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
 
 load_dotenv()
-max_retries = os.getenv('MAX_RETRIES')
+max_retries = int(os.getenv('MAX_RETRIES', 3))
+copy_block_size = int(os.getenv('COPY_BLOCK_SIZE', 16 * 1024 * 1024))
+progress_interval = float(os.getenv('COPY_PROGRESS_INTERVAL', 1))
+import_mode = os.getenv('IMPORT_MODE', 'copy').lower()
+preallocate_files = os.getenv('PREALLOCATE', 'True').lower() == 'true'
+copy_verify = os.getenv('COPY_VERIFY', 'size').lower()
+copy_verify_tail = int(os.getenv('COPY_VERIFY_TAIL', 0))
+copy_readahead = int(os.getenv('COPY_READAHEAD', 64 * 1024 * 1024))
+
+IMPORT_MODES = ('copy', 'symlink', 'hardlink')
+# 'none' trusts the copy, 'size' checks the bytes copied against the source and Real-Debrid sizes,
+# 'hash' also checksums the data as it is copied, so the result can be recorded
+VERIFY_MODES = ('none', 'size', 'hash')
+
+# Errors that mean a copy method isn't supported for this pair of files, rather than a failed copy
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP}
+
+# (method, source device, destination device) combinations that are known not to work
+unsupported_methods = set()
+
+FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def _load_fallocate():
+    """
+    Return libc's fallocate(2), which can reserve space without changing the file size
+    and, unlike posix_fallocate, never falls back to writing zeros. None if unavailable.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        fallocate = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).fallocate
+    except (OSError, AttributeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+_fallocate = _load_fallocate()
+
+
+def preallocate(fd, size, keep_size=False, enabled=preallocate_files):
+    """
+    Reserve `size` bytes of contiguous disk space for an open file without writing them.
+    With keep_size the file still looks empty, which is how placeholders are reserved.
+    Returns whether the space was reserved. Raises OSError if the disk is full.
+    """
+    if not enabled or not size or size <= 0:
+        return False
+    if _fallocate is not None:
+        if _fallocate(fd, FALLOC_FL_KEEP_SIZE if keep_size else 0, 0, size) == 0:
+            return True
+        error = ctypes.get_errno()
+        if error not in UNSUPPORTED_ERRNOS:
+            raise OSError(error, os.strerror(error))
+        return False
+    if not keep_size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return True
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+    return False
+
+
+class CopyVerificationError(OSError):
+    """
+    A copy didn't produce the bytes it should have.
+    """
+
+
+class SizeMismatchError(CopyVerificationError):
+    """
+    The source isn't the size Real-Debrid reports for the file, so copying it again can't help.
+    """
+
+
+def check_size(src, file_size, expected_size=None):
+    """
+    Raise SizeMismatchError if a source's size differs from the size Real-Debrid reported.
+    Checked before a copy starts, so a wrong file is never read.
+    """
+    if expected_size and file_size != expected_size:
+        COPY_VERIFY_FAILURES.inc('size')
+        raise SizeMismatchError(f"{src} is {file_size} bytes but Real-Debrid reports {expected_size}")
+
+
+class Crc32:
+    """
+    hashlib-style wrapper of zlib.crc32, the checksum used when neither xxhash nor blake3 is installed.
+    """
+    name = 'crc32'
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return f"{self.value:08x}"
+
+
+def new_checksum():
+    """
+    Return a running checksum using the fastest available algorithm: xxh3, then BLAKE3, then CRC32.
+    """
+    if xxhash is not None:
+        return xxhash.xxh3_64()
+    if blake3 is not None:
+        return blake3.blake3()
+    return Crc32()
+
+
+def checksum_name(checksum):
+    return 'xxh3_64' if xxhash is not None and isinstance(checksum, xxhash.xxh3_64) else checksum.name
+
+
+class ThrottledProgress:
+    """
+    Wrap a tqdm bar so it is only updated every `interval` seconds instead of on every block.
+    Each hook is also called with the size of every block, e.g. to rate limit the copy.
+    """
+
+    def __init__(self, pbar, interval=progress_interval, hooks=()):
+        self.pbar = pbar
+        self.interval = interval
+        self.hooks = [hook for hook in hooks if hook]
+        self.pending = 0
+        self.last_update = time.monotonic()
 
-def copy_file_with_progress(src, dst, max_retries=max_retries, retry_delay=2):
+    def update(self, n):
+        for hook in self.hooks:
+            hook(n)
+        self.pending += n
+        now = time.monotonic()
+        if now - self.last_update >= self.interval:
+            self.flush()
+            self.last_update = now
+
+    def flush(self):
+        if self.pending:
+            self.pbar.update(self.pending)
+            self.pending = 0
+
+
+class ReadAhead:
+    """
+    Ask the kernel to read a source file ahead of the copy in large windows, so a FUSE mount
+    gets a few big sequential requests in flight instead of one small read at a time.
+    """
+
+    def __init__(self, fd, window=copy_readahead):
+        self.fd = fd
+        self.window = window
+        self.position = 0
+        self.advised = 0  # End of the range already advised
+        if not window or not hasattr(os, 'posix_fadvise'):
+            self.window = 0
+            return
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+        self.advance(0)
+
+    def advance(self, n):
+        """
+        Note that n more bytes were copied and advise the next window once half of the current one is used.
+        """
+        if not self.window:
+            return
+        self.position += n
+        if self.advised - self.position < self.window // 2:
+            try:
+                os.posix_fadvise(self.fd, self.advised, self.window, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                self.window = 0  # Not supported by this filesystem
+                return
+            self.advised += self.window
+
+
+def _copy_with_copy_file_range(fsrc, fdst, offset, file_size, block_size, progress):
+    """
+    Copy inside the kernel with copy_file_range. Returns the new offset.
+    """
+    while offset < file_size:
+        copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(block_size, file_size - offset),
+                                    offset, offset)
+        if copied == 0:
+            break
+        offset += copied
+        progress.update(copied)
+    return offset
+
+
+def _copy_with_sendfile(fsrc, fdst, offset, file_size, block_size, progress):
+    """
+    Copy inside the kernel with sendfile. Returns the new offset.
+    """
+    os.lseek(fdst.fileno(), offset, os.SEEK_SET)
+    while offset < file_size:
+        sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, min(block_size, file_size - offset))
+        if sent == 0:
+            break
+        offset += sent
+        progress.update(sent)
+    return offset
+
+
+def _copy_with_readinto(fsrc, fdst, offset, file_size, block_size, progress, checksum=None):
+    """
+    Copy through one reused userspace buffer, updating the checksum with every block.
+    Returns the new offset.
+    """
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    buf = memoryview(bytearray(block_size))
+    while True:
+        n = fsrc.readinto(buf)
+        if not n:
+            break
+        view = buf[:n]
+        if checksum is not None:
+            checksum.update(view)
+        while view:
+            view = view[fdst.write(view):]
+        offset += n
+        progress.update(n)
+    return offset
+
+
+COPY_METHODS = []
+if hasattr(os, 'copy_file_range'):
+    COPY_METHODS.append(('copy_file_range', _copy_with_copy_file_range))
+if hasattr(os, 'sendfile') and os.name == 'posix':
+    COPY_METHODS.append(('sendfile', _copy_with_sendfile))
+COPY_METHODS.append(('readinto', _copy_with_readinto))
+
+
+def copy_file_contents(fsrc, fdst, file_size, progress, block_size=copy_block_size, checksum=None):
+    """
+    Copy an open source file into an open destination file using the fastest method that works:
+    copy_file_range, then sendfile, then a readinto loop into a reused buffer.
+    With a checksum only the readinto loop is used, since the data has to pass through userspace.
+    Returns the name of the method that finished the copy and the number of bytes copied.
+    """
+    if checksum is not None:
+        return 'readinto', _copy_with_readinto(fsrc, fdst, 0, file_size, block_size, progress, checksum)
+    devices = (os.fstat(fsrc.fileno()).st_dev, os.fstat(fdst.fileno()).st_dev)
+    offset = 0
+    for name, method in COPY_METHODS:
+        if (name, *devices) in unsupported_methods:
+            continue
+        try:
+            offset = method(fsrc, fdst, offset, file_size, block_size, progress)
+            if name == 'readinto' or offset >= file_size:
+                return name, offset
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS or name == 'readinto':
+                raise
+            unsupported_methods.add((name, *devices))
+    return name, offset
+
+
+def verify_copy(src, dst, file_size, copied, tail=copy_verify_tail):
     """
-    Copy a file from src to dst with a progress bar.
-    Retries the operation if it fails, up to a maximum number of retries.
+    Check a finished copy: every byte of the source was copied and optionally the last
+    `tail` bytes of both files match. Raises CopyVerificationError on a mismatch.
+    """
+    if copied != file_size:
+        COPY_VERIFY_FAILURES.inc('short_copy')
+        raise CopyVerificationError(f"Copied {copied} of {file_size} bytes of {src}")
+    if tail:
+        length = min(tail, file_size)
+        with open(src, 'rb', buffering=0) as fsrc, open(dst, 'rb', buffering=0) as fdst:
+            fsrc.seek(file_size - length)
+            fdst.seek(file_size - length)
+            if fsrc.read(length) != fdst.read(length):
+                COPY_VERIFY_FAILURES.inc('tail')
+                raise CopyVerificationError(f"The last {length} bytes of {dst} don't match {src}")
+
+
+def copy_file_with_progress(src, dst, max_retries=max_retries, retry_delay=2, block_size=copy_block_size,
+                            expected_size=None, verify=copy_verify, throttle=None):
+    """
+    Copy a file from src to dst with a progress bar, verifying it in the same pass.
+    Retries the operation if it fails or doesn't verify, up to a maximum number of retries.
+    A source that isn't expected_size bytes is rejected before copying, without retries.
+    Returns the checksum of the copied data as '<algorithm>:<hex digest>' when verify is 'hash'.
 
     Args:
         src (str): Source file path.
         dst (str): Destination file path.
-        max_retries (int): Maximum number of retry attempts (default: 3).
+        max_retries (int): Maximum number of retry attempts (default: MAX_RETRIES or 3).
         retry_delay (int): Delay in seconds between retries (default: 2).
+        block_size (int): Bytes copied per system call (default: COPY_BLOCK_SIZE or 16 MiB).
+        expected_size (int): Size Real-Debrid reports for the file, if known.
+        verify (str): One of VERIFY_MODES (default: COPY_VERIFY or 'size').
+        throttle (callable): Called with the size of each block copied, e.g. to limit bandwidth.
     """
+    if verify not in VERIFY_MODES:
+        raise ValueError(f"Unknown verify mode '{verify}'. Expected one of: {', '.join(VERIFY_MODES)}.")
     retries = 0
     while retries < int(max_retries):
         try:
@@ -26,27 +333,109 @@ def copy_file_with_progress(src, dst, max_retries=max_retries, retry_delay=2):
 
             # Get the size of the source file
             file_size = os.path.getsize(src)
+            if verify != 'none':
+                check_size(src, file_size, expected_size)
 
+            start = time.monotonic()
             # Initialize the progress bar
             with tqdm(total=file_size, unit='B', unit_scale=True, desc=os.path.basename(src)) as pbar:
-                # Copy the file with a callback to update the progress bar
-                with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
-                    while True:
-                        buf = fsrc.read((1024 * 1024) * 2)  # Read in chunks of 1MB
-                        if not buf:
-                            break
-                        fdst.write(buf)
-                        pbar.update(len(buf))  # Update the progress bar
-
-            print(f"File copied successfully to: {dst}")
-            return  # Exit the function if the copy succeeds
+                # Write into an existing (preallocated) dst in place instead of truncating it
+                dst_mode = 'r+b' if os.path.isfile(dst) else 'wb'
+                checksum = new_checksum() if verify == 'hash' else None
+                with open(src, 'rb', buffering=0) as fsrc, open(dst, dst_mode, buffering=0) as fdst:
+                    progress = ThrottledProgress(pbar, hooks=(ReadAhead(fsrc.fileno()).advance, throttle))
+                    preallocate(fdst.fileno(), file_size)
+                    method, copied = copy_file_contents(fsrc, fdst, file_size, progress, block_size, checksum)
+                    os.ftruncate(fdst.fileno(), file_size)
+                progress.flush()
+
+            digest = None
+            if verify != 'none':
+                verify_copy(src, dst, file_size, copied)
+            if checksum is not None:
+                digest = f"{checksum_name(checksum)}:{checksum.hexdigest()}"
+
+            elapsed = max(time.monotonic() - start, 1e-6)
+            COPY_SECONDS.observe(elapsed)
+            COPY_BYTES.inc(amount=file_size)
+            COPY_THROUGHPUT.observe(file_size / elapsed)
+            print(f"File copied successfully to: {dst} "
+                  f"({file_size / elapsed / (1024 * 1024):.1f} MB/s using {method}"
+                  f"{f', {digest}' if digest else ''})")
+            return digest  # Exit the function if the copy succeeds
 
+        except SizeMismatchError:
+            raise  # The same source will never be the right size
         except Exception as e:
             retries += 1
             print(f"Attempt {retries} failed: {e}")
-            if retries < max_retries:
+            if retries < int(max_retries):
                 print(f"Retrying in {retry_delay} seconds...")
                 time.sleep(retry_delay)
             else:
                 print(f"Max retries ({max_retries}) reached. Giving up.")
                 raise  # Re-raise the exception if all retries fail
+
+
+def import_file(src, dst, mode=import_mode, expected_size=None, verify=copy_verify, throttle=None):
+    """
+    Import a file from the rclone mount into an arr folder.
+
+    Args:
+        src (str): Source file path on the rclone mount.
+        dst (str): Destination file path. Anything already there is replaced atomically
+            so the arr never sees a half-made entry. A copy is written into the space
+            preallocated for the blank placeholder, which is moved aside while it fills.
+        mode (str): 'copy' copies the file, 'symlink' links to the file on the mount and
+            'hardlink' hard links it, falling back to a copy if src and dst are on
+            different filesystems (default: IMPORT_MODE or 'copy').
+        expected_size (int), verify (str): How a copy is verified;
+            see copy_file_with_progress. The size is checked before linking too.
+        throttle (callable): Called with the size of each block copied; see copy_file_with_progress.
+
+    Returns the checksum of a 'hash' verified copy, otherwise None.
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode '{mode}'. Expected one of: {', '.join(IMPORT_MODES)}.")
+    if verify != 'none':
+        check_size(src, os.path.getsize(src), expected_size)
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    # Build the entry under a hidden temporary name next to dst, then rename it into place
+    tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.partial")
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+
+    # Fill the placeholder's preallocated inode rather than a fresh one
+    placeholder = mode == 'copy' and os.path.isfile(dst) and not os.path.islink(dst) \
+        and os.path.getsize(dst) == 0
+    if placeholder:
+        os.replace(dst, tmp)
+
+    digest = None
+    try:
+        if mode == 'symlink':
+            os.symlink(src, tmp)
+        elif mode == 'hardlink':
+            try:
+                os.link(src, tmp)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP):
+                    raise
+                print(f"Cannot hardlink {src} ({e}). Copying instead.")
+                mode = 'copy'
+        if mode == 'copy':
+            digest = copy_file_with_progress(src, tmp, expected_size=expected_size, verify=verify,
+                                             throttle=throttle)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        if placeholder and not os.path.lexists(dst):
+            # Put a blank placeholder back for the next attempt
+            with open(dst, 'wb'):
+                pass
+        raise
+
+    print(f"Imported {src} to {dst} ({mode}).")
+    return digest
@@ -0,0 +1,255 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+job_db_path = os.getenv('JOB_DB_PATH', 'jobs.db')
+
+# Job states, in the order a job normally moves through them
+UPLOADED = 'uploaded'  # Torrent is downloaded on Real-Debrid, placeholder not created yet
+WAITING_ON_MOUNT = 'waiting_on_mount'  # Waiting for the file to appear on the rclone mount
+COPYING = 'copying'  # File is being imported into the arr folder
+DONE = 'done'
+FAILED = 'failed'
+
+JOB_STATES = (UPLOADED, WAITING_ON_MOUNT, COPYING, DONE, FAILED)
+LIVE_STATES = (UPLOADED, WAITING_ON_MOUNT, COPYING)  # Jobs that still have work to do
+
+# Torrent states in the dedup ledger
+TORRENT_UPLOADING = 'uploading'  # Being added to Real-Debrid or downloading there
+TORRENT_DOWNLOADED = 'downloaded'  # Downloaded on Real-Debrid; its jobs were created
+TORRENT_FAILED = 'failed'  # Not cached, dead or no video files; every grab of it is reported to the arr
+
+TORRENT_STATES = (TORRENT_UPLOADING, TORRENT_DOWNLOADED, TORRENT_FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL,
+    arr_folder TEXT NOT NULL,
+    state TEXT NOT NULL,
+    torrent_id TEXT,
+    infohash TEXT,
+    torrent_name TEXT,
+    size INTEGER,
+    checksum TEXT,
+    first_seen REAL NOT NULL,
+    next_check REAL NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (filename, arr_folder)
+);
+CREATE INDEX IF NOT EXISTS jobs_state_next_check ON jobs (state, next_check);
+CREATE INDEX IF NOT EXISTS jobs_infohash ON jobs (infohash);
+CREATE INDEX IF NOT EXISTS jobs_torrent_id ON jobs (torrent_id);
+CREATE TABLE IF NOT EXISTS torrents (
+    infohash TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    torrent_id TEXT,
+    torrent_name TEXT,
+    files TEXT,
+    updated REAL NOT NULL
+);
+"""
+
+# (column, definition) of columns added to the jobs table after its first release
+MIGRATIONS = [
+    ('torrent_name', 'TEXT'),
+    ('size', 'INTEGER'),
+    ('checksum', 'TEXT'),
+]
+
+
+class JobStore:
+    """
+    Crash-safe job store backed by SQLite in WAL mode.
+
+    Each job is one file to import into an arr folder. The torrents table is a ledger of
+    every infohash seen and its outcome on Real-Debrid, so duplicate drops and restarts
+    don't upload a torrent again. Writes are buffered and
+    committed together in one transaction, either by the background flusher every
+    flush_interval seconds or by an explicit flush(). Reads flush first, so callers
+    always see their own writes.
+    """
+
+    def __init__(self, db_path=job_db_path, flush_interval=1.0):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.pending = []  # Buffered (sql, params) writes
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        # A copy that was interrupted by a restart has to start over
+        self.conn.execute("UPDATE jobs SET state = ?, next_check = 0 WHERE state = ?", (WAITING_ON_MOUNT, COPYING))
+        self.conn.commit()
+        # In-memory front of the ledger, so unknown hashes are rejected without a query
+        self.known_infohashes = {row['infohash'] for row in self.conn.execute("SELECT infohash FROM torrents")}
+
+        self.running = True
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    def _migrate(self):
+        """
+        Add columns that were introduced after a database was created.
+        """
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in MIGRATIONS:
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    def add(self, jobs):
+        """
+        Save new jobs in one transaction and return them as saved. Each job is a dict with
+        filename and arr_folder and optionally state, torrent_id, infohash, torrent_name
+        and size (in bytes, as reported by Real-Debrid).
+        An existing job for the same file and arr folder is restarted.
+        Unlike the other writes this commits immediately, so a job is durable before
+        the magnet/torrent file it came from is deleted.
+        """
+        now = time.time()
+        saved = []
+        with self.lock:
+            self.flush()
+            with self.conn:
+                for job in jobs:
+                    self.conn.execute("""
+                        INSERT INTO jobs (filename, arr_folder, state, torrent_id, infohash, torrent_name,
+                                          size, first_seen, next_check, updated)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (filename, arr_folder) DO UPDATE SET
+                            state = excluded.state, torrent_id = excluded.torrent_id,
+                            infohash = excluded.infohash, torrent_name = excluded.torrent_name,
+                            size = excluded.size, first_seen = excluded.first_seen, next_check = excluded.next_check,
+                            updated = excluded.updated
+                    """, (job['filename'], job['arr_folder'], job.get('state', WAITING_ON_MOUNT),
+                          job.get('torrent_id'), job.get('infohash'), job.get('torrent_name'),
+                          job.get('size'), now, now, now))
+                    row = self.conn.execute("SELECT * FROM jobs WHERE filename = ? AND arr_folder = ?",
+                                            (job['filename'], job['arr_folder'])).fetchone()
+                    saved.append(dict(row))
+        return saved
+
+    def update(self, job_id, **fields):
+        """
+        Buffer an update of the given columns of a job.
+        """
+        fields['updated'] = time.time()
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        self._write(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def set_state(self, job_id, state, next_check=None):
+        """
+        Buffer a state change, optionally rescheduling the job's next check.
+        """
+        if state not in JOB_STATES:
+            raise ValueError(f"Unknown job state '{state}'.")
+        if next_check is None:
+            self.update(job_id, state=state)
+        else:
+            self.update(job_id, state=state, next_check=next_check)
+
+    def record_torrent(self, infohash, state, torrent_id=None, torrent_name=None, files=None, sizes=None):
+        """
+        Buffer the outcome of a torrent in the ledger. files is the list of video file names
+        and sizes their sizes in bytes.
+        """
+        if state not in TORRENT_STATES:
+            raise ValueError(f"Unknown torrent state '{state}'.")
+        with self.lock:
+            self.known_infohashes.add(infohash)
+            self._write("""
+                INSERT INTO torrents (infohash, state, torrent_id, torrent_name, files, updated)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (infohash) DO UPDATE SET
+                    state = excluded.state, torrent_id = excluded.torrent_id,
+                    torrent_name = excluded.torrent_name, files = excluded.files, updated = excluded.updated
+            """, (infohash, state, torrent_id, torrent_name,
+                  json.dumps({"files": files, "sizes": sizes}) if files is not None else None, time.time()))
+
+    def get_torrent(self, infohash):
+        """
+        Return the ledger entry of an infohash, or None if it has never been seen.
+        """
+        if infohash not in self.known_infohashes:
+            return None
+        rows = self._query("SELECT * FROM torrents WHERE infohash = ?", (infohash,))
+        if not rows:
+            return None
+        torrent = rows[0]
+        files = json.loads(torrent['files']) if torrent['files'] else {}
+        if isinstance(files, list):
+            files = {"files": files}  # Saved before sizes were recorded
+        torrent['files'] = files.get("files") or []
+        torrent['sizes'] = files.get("sizes")
+        return torrent
+
+    def jobs_for_torrent(self, infohash, arr_folder=None):
+        """
+        Return the jobs created from a torrent, optionally only those for one arr folder.
+        """
+        if arr_folder is None:
+            return self._query("SELECT * FROM jobs WHERE infohash = ?", (infohash,))
+        return self._query("SELECT * FROM jobs WHERE infohash = ? AND arr_folder = ?", (infohash, arr_folder))
+
+    def verified_checksum(self, infohash, filename, size=None):
+        """
+        Return the checksum of an earlier verified import of the same file (name and size) from the
+        same torrent, or None. Checksums are only saved by finished imports and are kept when a job
+        is restarted.
+        """
+        if not infohash:
+            return None
+        rows = self._query("SELECT checksum FROM jobs WHERE infohash = ? AND filename = ? AND size IS ? "
+                           "AND checksum IS NOT NULL LIMIT 1", (infohash, filename, size))
+        return rows[0]['checksum'] if rows else None
+
+    def _write(self, sql, params):
+        with self.lock:
+            self.pending.append((sql, params))
+
+    def flush(self):
+        """
+        Commit all buffered writes in a single transaction.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, []
+            with self.conn:
+                for sql, params in pending:
+                    self.conn.execute(sql, params)
+
+    def _flush_loop(self):
+        while self.running:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Error saving jobs: {e}")
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            self.flush()
+            return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def jobs_in_state(self, state):
+        """
+        Return every job in the given state.
+        """
+        return self._query("SELECT * FROM jobs WHERE state = ? ORDER BY first_seen", (state,))
+
+    def close(self):
+        """
+        Stop the background flusher, commit buffered writes and close the database.
+        """
+        self.running = False
+        with self.lock:
+            self.flush()
+            self.conn.close()
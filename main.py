@@ -1,63 +1,63 @@
 import os
-import queue
+import signal
 import threading
-import pickle
 from dotenv import load_dotenv
 from watchdog.observers import Observer
-from watchdog.observers.polling import PollingObserver
 
 from monitor import MagnetFileHandler, RcloneFileHandler
+from jobs import JobStore
+from arrs import arrs_folders, monitored_folders, flush_failure_reports
+from metrics import start_metrics_server
+from tracing import start_tracing, stop_tracing
 import time
 
 load_dotenv()
 
 print('Starting monitors...')
 
-# Set up the folders to monitor
-magnet_folder = os.getenv('ARR_TORRENTS_PATH')
-downloads_folder = os.getenv('ARR_DOWNLOAD_PATH')
+# Set up the folders to monitor: the torrent folder of every arr instance (see ARR_INSTANCES)
+arrs_folders()
+magnet_folders = monitored_folders()
 rclone_folder = os.getenv('RCLONE_PATH')
 
 
 
-# Create a queue to store new magnets
-magnet_queue = queue.Queue()
+# Serve Prometheus metrics if METRICS_PORT is set
+start_metrics_server()
 
-# Load the queue from a file if it exists
-queue_file = 'magnet_queue.pkl'
-if os.path.exists(queue_file):
-    try:
-        with open(queue_file, 'rb') as f:
-            saved_queue = pickle.load(f)
-            while not saved_queue.empty():
-                magnet_queue.put(saved_queue.get())
-        print("Loaded queue from file.")
-    except Exception as e:
-        print(f"Queue Empty: {e}")
+# Write per-job trace spans if TRACE_FILE is set
+start_tracing()
 
-# Create a lock to ensure only one item is processed at a time in RcloneFileHandler
-rclone_lock = threading.Lock()
+# Open the job store. Jobs saved before a restart are picked up where they left off.
+job_store = JobStore()
 
-# Create observers for both folders
-magnet_event_handler = MagnetFileHandler(magnet_folder, magnet_queue)
-rclone_event_handler = RcloneFileHandler(rclone_folder, magnet_queue, rclone_lock)
+# Treat SIGTERM (e.g. docker stop) like Ctrl+C so the handlers shut down cleanly
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+signal.signal(signal.SIGTERM, handle_sigterm)
+
+# Create observers for both folders. Imports run on the copy slots set by COPY_SLOTS.
+rclone_event_handler = RcloneFileHandler(rclone_folder, job_store)
+magnet_event_handler = MagnetFileHandler(magnet_folders, job_store, on_jobs_queued=rclone_event_handler.schedule_torrent)
 
 # Start the RcloneFileHandler processing loop in a separate thread
 rclone_thread = threading.Thread(target=rclone_event_handler.start_processing)
 rclone_thread.start()
 
-# Create and start the observers
+# Create and start the observers. Mount changes come from the source selected by MOUNT_WATCHER.
 magnet_observer = Observer()
-rclone_observer = PollingObserver()
+rclone_observer = rclone_event_handler.mount_source
 
-magnet_observer.schedule(magnet_event_handler, magnet_folder, recursive=True)
-rclone_observer.schedule(rclone_event_handler, rclone_folder, recursive=True)
+for magnet_folder in magnet_folders:
+    magnet_observer.schedule(magnet_event_handler, magnet_folder, recursive=True)
 
-# Start the observers
+# Start the observers, then pick up the magnet files and jobs left from before a restart in the background
 magnet_observer.start()
 rclone_observer.start()
+magnet_event_handler.start_reconciliation()
 
-print(f"Monitoring magnet folder: {magnet_folder}")
+print(f"Monitoring magnet folders: {', '.join(magnet_folders)}")
 print(f"Monitoring rclone folder: {rclone_folder}")
 
 
@@ -65,19 +65,15 @@ try:
     while True:
         time.sleep(1)  # Keep the main thread alive
 except KeyboardInterrupt:
-    print("Program interrupted. Saving queue and stopping handlers...")
+    print("Program interrupted. Stopping handlers...")
     magnet_observer.stop()
     rclone_observer.stop()
+    magnet_event_handler.stop_processing()  # Stop the magnet/torrent worker pool
     rclone_event_handler.stop_processing()  # Stop the RcloneFileHandler processing loop
 
-    # Save the queue to a file
-    try:
-        with open(queue_file, 'wb') as f:
-            pickle.dump(magnet_queue, f)
-        print("Queue saved to file.")
-    except Exception as e:
-        print(f"Error saving queue to file: {e}")
-
 magnet_observer.join()
 rclone_observer.join()
 rclone_thread.join()  # Wait for the RcloneFileHandler thread to finish
+flush_failure_reports()  # Report failures still waiting for their batch
+job_store.close()  # Save any buffered job updates
+stop_tracing()  # Write the remaining trace spans
@@ -0,0 +1,168 @@
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+metrics_port = os.getenv('METRICS_PORT')
+
+# Latency buckets in seconds for API calls and lookups
+FAST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Buckets in seconds for steps that take minutes (downloads, waiting on the mount, copies)
+SLOW_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+# Buckets in bytes per second for copy throughput
+THROUGHPUT_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+class Metric:
+    """
+    Base class for a metric with optional labels, rendered in the Prometheus text format.
+    """
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> value
+        registry.append(self)
+
+    def _label_string(self, label_values, extra=()):
+        pairs = list(zip(self.labels, label_values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{self._label_string(label_values)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self.function = function  # Called at scrape time for unlabelled gauges
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def render(self):
+        if self.function:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                print(f"Error reading metric {self.name}: {e}")
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=FAST_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            counts, total = self.values.get(label_values, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[label_values] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for label_values, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{self.name}_bucket{self._label_string(label_values, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{self._label_string(label_values)} {total}")
+                lines.append(f"{self.name}_count{self._label_string(label_values)} {cumulative}")
+        return lines
+
+
+registry = []
+
+QUEUE_DEPTH = Gauge('blackhole_queue_depth', 'Jobs waiting for their file to appear on the rclone mount')
+TORRENTS_IN_FLIGHT = Gauge('blackhole_torrents_in_flight', 'Magnet/torrent files being processed with Real-Debrid')
+RD_REQUESTS = Counter('blackhole_rd_requests_total', 'Real-Debrid API requests', ('endpoint', 'status'))
+RD_LATENCY = Histogram('blackhole_rd_request_seconds', 'Real-Debrid API request latency', ('endpoint',))
+TORRENT_DOWNLOAD_SECONDS = Histogram('blackhole_torrent_download_seconds',
+                                     'Time from magnet drop to the torrent being downloaded on Real-Debrid',
+                                     buckets=SLOW_BUCKETS)
+MOUNT_WAIT_SECONDS = Histogram('blackhole_mount_wait_seconds',
+                               'Time from the torrent being downloaded to its file appearing on the rclone mount',
+                               buckets=SLOW_BUCKETS)
+COPY_SECONDS = Histogram('blackhole_copy_seconds', 'Duration of file copies into the arr folders',
+                         buckets=SLOW_BUCKETS)
+COPY_BYTES = Counter('blackhole_copy_bytes_total', 'Bytes copied into the arr folders')
+COPY_THROUGHPUT = Histogram('blackhole_copy_throughput_bytes_per_second', 'Throughput of file copies',
+                            buckets=THROUGHPUT_BUCKETS)
+COPIES_QUEUED = Gauge('blackhole_copies_queued', 'Imports waiting for a copy slot')
+COPIES_ACTIVE = Gauge('blackhole_copies_active', 'Imports running on a copy slot')
+COPY_VERIFY_FAILURES = Counter('blackhole_copy_verify_failures_total', 'Copies that failed verification',
+                               ('check',))
+MOUNT_LOOKUP_SECONDS = Histogram('blackhole_mount_lookup_seconds', 'Latency of rclone mount index lookups')
+MOUNT_INDEX_BUILD_SECONDS = Histogram('blackhole_mount_index_build_seconds',
+                                      'Duration of full rclone mount index builds', buckets=SLOW_BUCKETS)
+ARR_FAILURES = Counter('blackhole_arr_failures_total', 'Releases reported as failed to Sonarr/Radarr',
+                       ('arr', 'result'))
+
+
+def render():
+    """
+    Render every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Don't print a line for every scrape
+
+
+def start_metrics_server(port=metrics_port):
+    """
+    Serve /metrics on the given port in a background thread. Does nothing if no port is set.
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('', int(port)), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"Serving metrics on port {port}")
+    return server
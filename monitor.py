@@ -1,13 +1,43 @@
 import os
+import threading
 import time
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
 from watchdog.events import FileSystemEventHandler
-from real_debrid import upload_magnet_to_realdebrid
-from download import copy_file_with_progress
-from arrs import get_arr_folder, create_locked_mkv_file, delete_blank_mkv_file, search_and_mark_failed
-from torrents import read_magnet_file
+from real_debrid import (upload_magnet_to_realdebrid, reuse_library_torrent, remove_torrent, instant_availability,
+                         get_download_link, VIDEO_EXTENSIONS)
+from download import import_file, import_mode, copy_verify, SizeMismatchError
+from direct import uses_direct_download, download_file
+from arrs import get_arr_folder, create_locked_mkv_file, delete_blank_mkv_file, search_and_mark_failed, find_instance
+from torrents import read_magnet_file, get_infohash, delete_file_with_retry
+from mount import MountIndex, create_mount_source
+from jobs import (UPLOADED, WAITING_ON_MOUNT, COPYING, DONE, FAILED, LIVE_STATES,
+                  TORRENT_UPLOADING, TORRENT_DOWNLOADED, TORRENT_FAILED)
+from scheduler import DeadlineScheduler
+from copies import CopyScheduler
+from metrics import QUEUE_DEPTH, TORRENTS_IN_FLIGHT, TORRENT_DOWNLOAD_SECONDS, MOUNT_WAIT_SECONDS
+from tracing import span, trace_job
 
-def wait():
-    time.sleep(1)
+load_dotenv()
+max_concurrent_torrents = int(os.getenv('MAX_CONCURRENT_TORRENTS', 10))
+dedup_failed_ttl = int(os.getenv('DEDUP_FAILED_TTL', 24 * 60 * 60))
+
+
+def torrent_key(job):
+    """
+    Return the key that groups a job with the other files of its torrent in the same arr folder.
+    """
+    return (job['infohash'] or job['torrent_id'] or f"job {job['id']}", job['arr_folder'])
+
+
+def group_jobs(jobs):
+    """
+    Split jobs into lists of the files of one torrent, in the order first seen.
+    """
+    groups = OrderedDict()
+    for job in jobs:
+        groups.setdefault(torrent_key(job), []).append(job)
+    return list(groups.values())
 
 # Removing tinydb, it is unreliable for what is needed.
 # # Initialize TinyDB
@@ -15,43 +45,256 @@ def wait():
 
 class MagnetFileHandler(FileSystemEventHandler):
 
-    def __init__(self, magnet_folder, magnet_queue):
+    def __init__(self, magnet_folder, job_store, on_jobs_queued=None, max_workers=max_concurrent_torrents):
+        """
+        Initialize the MagnetFileHandler with the folder (or list of folders) to monitor.
+        Each magnet/torrent file is processed as its own job on a bounded worker pool,
+        so one slow torrent doesn't hold up the others. Every arr instance has its own queue
+        and the workers take from the queues in turn, so one busy instance can't starve the others.
+        on_jobs_queued is called with the jobs of a torrent once they start waiting on the rclone mount.
+        Files already in the folders are picked up by start_reconciliation(), once the
+        observers are watching for new ones.
+        """
+        self.magnet_folders = [magnet_folder] if isinstance(magnet_folder, str) else list(magnet_folder)
+        self.job_store = job_store
+        self.on_jobs_queued = on_jobs_queued
+        self.stop_event = threading.Event()
+        self.queues = OrderedDict()  # arr instance name -> deque of (file path, delay), served round robin
+        self.queue_condition = threading.Condition()
+        self.workers = [threading.Thread(target=self._worker, name=f'torrent-{i}', daemon=True)
+                        for i in range(max(1, max_workers))]
+        for worker in self.workers:
+            worker.start()
+        self.in_flight = set()  # Magnet/torrent file paths with a job submitted or running
+        self.duplicates = {}  # infohash being processed -> other files dropped for it meanwhile
+        self.in_flight_lock = threading.Lock()
+        TORRENTS_IN_FLIGHT.set_function(lambda: len(self.in_flight))
+        self.reconciliation = None
+
+    def start_reconciliation(self):
         """
-        Initialize the MagnetFileHandler with the folder to monitor.
+        Reconcile the magnet folders with the job store in the background, so startup
+        doesn't wait on a backlog of magnet files.
         """
-        self.magnet_folder = magnet_folder
-        self.magnet_queue = magnet_queue
-        self.process_existing_magnets()
+        self.reconciliation = threading.Thread(target=self.reconcile, name='reconcile', daemon=True)
+        self.reconciliation.start()
+
+    def reconcile(self):
+        """
+        Pick up the work that was pending before a restart.
+        """
+        try:
+            self.resume_uploaded_jobs()
+            self.process_existing_magnets()
+        except Exception as e:
+            print(f"Error reconciling magnet folders: {e}")
+
+    def resume_uploaded_jobs(self):
+        """
+        Create the placeholders of jobs that were saved but not queued before a restart.
+        """
+        for jobs in group_jobs(self.job_store.jobs_in_state(UPLOADED)):
+            self.queue_jobs(jobs)
+        self.job_store.flush()
+
+    def queue_jobs(self, jobs):
+        """
+        Create the blank locked .mkv files for the jobs of a torrent and hand them to the RcloneFileHandler together.
+        Disk space is only reserved for files that will be written locally (copies and direct downloads),
+        not for symlinks or hardlinks.
+        """
+        for job in jobs:
+            mkv_file_path = os.path.join(job['arr_folder'], job['filename'])
+            local = import_mode == 'copy' or uses_direct_download(job['arr_folder'])
+            create_locked_mkv_file(mkv_file_path, job.get('size') if local else None)
+            self.job_store.set_state(job['id'], WAITING_ON_MOUNT)
+            job['state'] = WAITING_ON_MOUNT
+            print(f"Added to queue: {job['filename']} (arr_folder: {job['arr_folder']})")
+        if self.on_jobs_queued:
+            self.on_jobs_queued(jobs)
 
     def process_existing_magnets(self):
         """
-        Process existing .magnet files in the magnet folder when the script starts.
+        Diff the magnet/torrent files already in the magnet folders against the torrent ledger.
+        Files of torrents that finished or failed before the restart are only merged with their
+        jobs, and torrents that were still on Real-Debrid are resumed by id (see _process_torrent),
+        so they are queued first. New torrents get their instant availability checked in a few
+        batched requests before they are queued.
         """
         print("Checking for existing magnet/torrent files...")
-        for root, _, files in os.walk(self.magnet_folder):
-            for file in files:
-                if file.endswith(".magnet") or file.endswith(".torrent"):
+        known, new = [], {}  # file paths; file path -> infohash
+        for magnet_folder in self.magnet_folders:
+            for root, _, files in os.walk(magnet_folder):
+                for file in files:
+                    if not (file.endswith(".magnet") or file.endswith(".torrent")):
+                        continue
                     file_path = os.path.join(root, file)
-                    self.process_magnet_file(file_path)
+                    infohash = get_infohash(read_magnet_file(file_path))
+                    if infohash and self.job_store.get_torrent(infohash):
+                        known.append(file_path)
+                    else:
+                        new[file_path] = infohash
+        print(f"Found {len(known) + len(new)} existing magnet/torrent files, {len(known)} of them already known.")
+
+        for file_path in known:
+            self.submit_magnet_file(file_path)
+        if new and instant_availability.enabled:
+            instant_availability.check([infohash for infohash in new.values() if infohash])
+        for file_path in new:
+            self.submit_magnet_file(file_path)
+
+    def submit_magnet_file(self, file_path, delay=0):
+        """
+        Queue a magnet/torrent file to be processed on the worker pool, behind the other files
+        of its arr instance. Files that already have a job in flight are skipped.
+        """
+        with self.in_flight_lock:
+            if file_path in self.in_flight:
+                return
+            self.in_flight.add(file_path)
+        instance = find_instance(file_path)
+        with self.queue_condition:
+            self.queues.setdefault(instance.name if instance else '', deque()).append((file_path, delay))
+            self.queue_condition.notify()
+
+    def _worker(self):
+        """
+        Take magnet/torrent files from the instance queues in turn and process them.
+        """
+        while True:
+            with self.queue_condition:
+                while not self.stop_event.is_set() and not any(self.queues.values()):
+                    self.queue_condition.wait()
+                if self.stop_event.is_set():
+                    return
+                name, queue = next((name, queue) for name, queue in self.queues.items() if queue)
+                file_path, delay = queue.popleft()
+                self.queues.move_to_end(name)  # The next file comes from another instance
+            self._run_job(file_path, delay)
+
+    def _run_job(self, file_path, delay):
+        """
+        Run one magnet/torrent job, logging any error instead of losing it in the worker pool.
+        """
+        try:
+            if delay and self.stop_event.wait(delay):
+                return
+            self.process_magnet_file(file_path)
+        except Exception as e:
+            print(f"Error processing magnet/torrent file {file_path}: {e}")
+        finally:
+            with self.in_flight_lock:
+                self.in_flight.discard(file_path)
 
     def process_magnet_file(self, file_path):
         """
         Process a single .magnet file.
+        A torrent that is already being processed, or that the ledger says was downloaded
+        or failed, is merged with the existing job instead of being uploaded again.
         """
         print(f"Processing magnet/torrent file: {file_path}")
+        dropped = os.path.getmtime(file_path)
         magnet_link = read_magnet_file(file_path)
-        result = upload_magnet_to_realdebrid(magnet_link=magnet_link, magnet_file_path=file_path)
-        if result:
-            arr_folder = get_arr_folder(file_path)
-            if arr_folder:
-                for file_name in result['filename']:
-                    self.magnet_queue.put({"filename": file_name, "arr_folder": arr_folder})
-                    print(f"Added to queue: {file_name} (arr_folder: {arr_folder})")
-                    wait()
+        infohash = get_infohash(magnet_link)
+        with trace_job(infohash), span("torrent", file=os.path.basename(file_path)):
+            self._process_torrent(file_path, magnet_link, infohash, dropped)
+
+    def _process_torrent(self, file_path, magnet_link, infohash, dropped):
+        """
+        Upload, merge or reuse the torrent of a magnet file and create its jobs.
+        """
+        if infohash:
+            with self.in_flight_lock:
+                if infohash in self.duplicates:
+                    print(f"Torrent {infohash} is already being processed. Merging {file_path} into it.")
+                    self.duplicates[infohash].append(file_path)
+                    return
+                self.duplicates[infohash] = []
 
-                    # Create a blank locked .mkv file in the arr_folder
-                    mkv_file_path = os.path.join(arr_folder, file_name)
-                    create_locked_mkv_file(mkv_file_path)
+        result = None
+        skipped = False  # Failed recently, so the upload didn't report this grab
+        try:
+            torrent = self.job_store.get_torrent(infohash) if infohash else None
+            if torrent and torrent['state'] == TORRENT_DOWNLOADED:
+                print(f"Torrent {infohash} was already downloaded to Real-Debrid. Reusing it.")
+                result = {"id": torrent['torrent_id'], "name": torrent['torrent_name'],
+                          "filename": torrent['files'], "sizes": torrent['sizes']}
+            elif torrent and torrent['state'] == TORRENT_FAILED and time.time() - torrent['updated'] < dedup_failed_ttl:
+                print(f"Torrent {infohash} already failed. Skipping upload and marking this grab as failed.")
+                skipped = True
+            else:
+                if torrent and torrent['state'] == TORRENT_UPLOADING and torrent['torrent_id']:
+                    # Added before a restart; wait on the same torrent instead of adding it again
+                    print(f"Resuming torrent {infohash} on Real-Debrid as {torrent['torrent_id']}.")
+                    result = reuse_library_torrent({"id": torrent['torrent_id']}, self.stop_event)
+                    if not result and not self.stop_event.is_set():
+                        # e.g. stopped before its files were selected; add it again from scratch
+                        try:
+                            remove_torrent(torrent['torrent_id'])
+                        except Exception as e:
+                            print(f"Failed to remove torrent {torrent['torrent_id']}: {e}")
+                elif infohash:
+                    self.job_store.record_torrent(infohash, TORRENT_UPLOADING)
+                if not result and not self.stop_event.is_set():
+                    on_added = (lambda torrent_id: self.job_store.record_torrent(infohash, TORRENT_UPLOADING,
+                                                                                 torrent_id)) if infohash else None
+                    result = upload_magnet_to_realdebrid(magnet_link=magnet_link, magnet_file_path=file_path,
+                                                         stop_event=self.stop_event, delete_magnet_file=False,
+                                                         on_added=on_added)
+                if result:
+                    TORRENT_DOWNLOAD_SECONDS.observe(time.time() - dropped)
+                    if infohash:
+                        self.job_store.record_torrent(infohash, TORRENT_DOWNLOADED, result['id'],
+                                                      result.get('name'), result['filename'], result.get('sizes'))
+                elif self.stop_event.is_set():
+                    return  # Interrupted; the magnet file is picked up again on the next start
+                elif infohash:
+                    self.job_store.record_torrent(infohash, TORRENT_FAILED)
+        finally:
+            with self.in_flight_lock:
+                duplicates = self.duplicates.pop(infohash, []) if infohash else []
+
+        for path in [file_path] + duplicates:
+            if result:
+                self.add_jobs(path, infohash, result)
+            elif path != file_path or skipped:
+                release_title = os.path.basename(path).replace(".magnet", "").replace(".torrent", "")
+                search_and_mark_failed(release_title, path, infohash)
+        # Save the jobs and ledger before deleting the magnet files so a crash can't lose them
+        self.job_store.flush()
+        for path in [file_path] + duplicates:
+            if os.path.exists(path):
+                delete_file_with_retry(path)
+
+    def add_jobs(self, file_path, infohash, result):
+        """
+        Save and queue the jobs of a downloaded torrent for the arr folder a magnet file was dropped in,
+        unless that arr folder already has live jobs for the torrent. A torrent that was already
+        imported is imported again for a new grab, but not for a magnet file that is older than
+        the import (left behind by a restart before it was deleted).
+        """
+        arr_folder = get_arr_folder(file_path)
+        if not arr_folder:
+            return
+        existing = self.job_store.jobs_for_torrent(infohash, arr_folder) if infohash else []
+        if any(job['state'] in LIVE_STATES for job in existing):
+            print(f"Torrent {infohash} already has jobs in {arr_folder}. Merging {file_path} into them.")
+            return
+        imported = [job['updated'] for job in existing if job['state'] == DONE]
+        try:
+            dropped = os.path.getmtime(file_path)
+        except OSError:
+            dropped = None
+        if imported and dropped is not None and dropped < max(imported):
+            print(f"Torrent {infohash} was already imported to {arr_folder} after {file_path} was dropped.")
+            return
+        sizes = result.get('sizes') or [None] * len(result['filename'])
+        jobs = self.job_store.add([
+            {"filename": file_name, "arr_folder": arr_folder, "state": UPLOADED, "torrent_id": result['id'],
+             "infohash": infohash, "torrent_name": result.get('name'), "size": size}
+            for file_name, size in zip(result['filename'], sizes)
+        ])
+        self.queue_jobs(jobs)
 
 
     def on_created(self, event):
@@ -60,82 +303,376 @@ class MagnetFileHandler(FileSystemEventHandler):
         """
         file_path = event.src_path
         print(f"Created: {file_path}")
-        time.sleep(0.5)
 
         if file_path.endswith(".magnet") or file_path.endswith(".torrent"):
-            self.process_magnet_file(file_path)
+            # Give the arr a moment to finish writing the file
+            self.submit_magnet_file(file_path, delay=0.5)
+
+    def stop_processing(self):
+        """
+        Stop accepting new jobs and tell running jobs to stop waiting on Real-Debrid.
+        """
+        self.stop_event.set()
+        with self.queue_condition:
+            self.queues.clear()
+            self.queue_condition.notify_all()
 
 class RcloneFileHandler(FileSystemEventHandler):
-    def __init__(self, rclone_folder, magnet_queue, rclone_lock):
+    def __init__(self, rclone_folder, job_store, copy_scheduler=None):
         """
-        Initialize the RcloneFileHandler with the folder to monitor, the queue, and the lock.
+        Initialize the RcloneFileHandler with the folder to monitor, the job store, and the
+        copy scheduler that runs the imports (default: one configured from the environment).
         """
         self.rclone_folder = rclone_folder
-        self.magnet_queue = magnet_queue
-        self.rclone_lock = rclone_lock
+        self.job_store = job_store
+        self.copy_scheduler = copy_scheduler or CopyScheduler()
         self.running = True  # Flag to control the loop
         self.file_timeout = 60 * 60
-        self.file_timers = {}
+        self.mount_index = MountIndex(rclone_folder)
+        self.scheduler = DeadlineScheduler()
+        QUEUE_DEPTH.set_function(lambda: len(self.scheduler))
+        self.torrents = {}  # torrent key -> torrent being waited on or imported (see schedule_torrent)
+        self.waiting = {}  # file name on the mount -> keys of the torrents waiting for it
+        self.waiting_lock = threading.Lock()
+        # Dispatch torrents as soon as one of their files shows up on the mount
+        self.mount_index.on_added.append(self.file_appeared)
+        self.mount_index.on_built.append(self.scheduler.wake_all)
+        # Source of mount change events (see MOUNT_WATCHER); started and stopped by the caller
+        self.mount_source = create_mount_source(self, rclone_folder)
+
+    def mount_folders(self, group):
+        """
+        Return the folder names zurg may use for a torrent on the mount.
+        """
+        name = group.get('torrent_name')
+        if not name or uses_direct_download(group['arr_folder']):
+            return []
+        folders = [name]
+        base, extension = os.path.splitext(name)
+        if extension.lower() in VIDEO_EXTENSIONS:
+            folders.append(base)  # Single-file torrents may be shown without the extension
+        return folders
+
+    def schedule_torrent(self, jobs, due=None):
+        """
+        Schedule the jobs of a torrent waiting on the rclone mount to be checked together
+        at the given time (default: now). Jobs of a torrent that is already tracked join it.
+        """
+        key = torrent_key(jobs[0])
+        with self.waiting_lock:
+            group = self.torrents.get(key)
+            new = group is None
+            if new:
+                group = {"key": key, "arr_folder": jobs[0]['arr_folder'], "infohash": jobs[0]['infohash'],
+                         "torrent_id": jobs[0]['torrent_id'], "torrent_name": jobs[0].get('torrent_name'),
+                         "first_seen": jobs[0]['first_seen'], "jobs": {}, "files": set()}
+                self.torrents[key] = group
+            for job in jobs:
+                group['jobs'][job['id']] = job
+                group['first_seen'] = min(group['first_seen'], job['first_seen'])
+                # The mount shows the files of a pack by their own names, without RD's subfolders
+                file_name = os.path.basename(job['filename'])
+                group['files'].add(file_name)
+                self.waiting.setdefault(file_name, set()).add(key)
+        if new:
+            for folder in self.mount_folders(group):
+                self.mount_source.watch(folder)
+        self.scheduler.schedule(key, group, due)
+
+    def unschedule_torrent(self, group):
+        """
+        Stop tracking a torrent whose files were imported or failed.
+        """
+        with self.waiting_lock:
+            tracked = self.torrents.pop(group['key'], None) is not None
+            for file_name in group['files']:
+                keys = self.waiting.get(file_name, set())
+                keys.discard(group['key'])
+                if not keys:
+                    self.waiting.pop(file_name, None)
+        if tracked:
+            for folder in self.mount_folders(group):
+                self.mount_source.unwatch(folder)
+        self.scheduler.remove(group['key'])
+
+    def file_appeared(self, file_name, path):
+        """
+        Wake the torrents waiting for a file that was just added to the mount index.
+        """
+        with self.waiting_lock:
+            keys = list(self.waiting.get(file_name, ()))
+        for key in keys:
+            self.scheduler.wake(key)
+
+    def on_created(self, event):
+        """
+        Add new files on the rclone mount to the index.
+        """
+        if event.is_directory:
+            self.mount_index.add_directory(event.src_path)
+        else:
+            self.mount_index.add(event.src_path)
+
+    def on_deleted(self, event):
+        """
+        Remove deleted files from the index.
+        """
+        if event.is_directory:
+            self.mount_index.remove_directory(event.src_path)
+        else:
+            self.mount_index.remove(event.src_path)
+
+    def on_moved(self, event):
+        """
+        Re-index files that were moved or renamed on the rclone mount.
+        """
+        if event.is_directory:
+            self.mount_index.remove_directory(event.src_path)
+            self.mount_index.add_directory(event.dest_path)
+        else:
+            self.mount_index.remove(event.src_path)
+            self.mount_index.add(event.dest_path)
 
     def start_processing(self):
         """
-        Continuously process files in the queue by searching for them by name in the rclone folder and its subfolders.
-        Filenames are compared in lowercase to match the queue entries.
+        Continuously process the waiting torrents by looking their files up by name in the rclone folder index.
         """
+        self.mount_index.start()
+        self.mount_index.wait_ready()
+
+        # Pick up the jobs that were waiting before a restart
+        for jobs in group_jobs(self.job_store.jobs_in_state(WAITING_ON_MOUNT)):
+            self.schedule_torrent(jobs, min(job['next_check'] for job in jobs))
+
         while self.running:
-            with self.rclone_lock:  # Acquire the lock to ensure only one item is processed at a time
-                if not self.magnet_queue.empty():
-                    item = self.magnet_queue.get()
-                    file_name = item["filename"]  # Filename in the queue is already lowercase
-                    arr_folder = item["arr_folder"]
-
-                    # Initialize the timer for the file if it's not already being tracked
-                    if file_name not in self.file_timers:
-                        self.file_timers[file_name] = time.time()
-
-                    # Search for the file by name in the rclone folder and its subfolders
-                    file_found = False
-                    for root, _, files in os.walk(self.rclone_folder):
-                        for entry_name in files:
-                            if entry_name == file_name:  # Compare filenames in lowercase
-                                file_path = os.path.join(root, entry_name)
-                                print(f"File found in rclone folder: {file_path}")
-
-                                # Delete the blank locked .mkv file before copying the actual file
-                                mkv_file_path = os.path.join(arr_folder, file_name)
-                                delete_blank_mkv_file(mkv_file_path)
-
-                                # Copy the actual file to the arr_folder
-                                dst_file = os.path.join(arr_folder, file_name)
-                                copy_file_with_progress(file_path, dst_file)
-                                file_found = True
-                                break
-                        if file_found:
-                            break
-
-                    if not file_found:
-                        # Check if the file has been in the queue for longer than the timeout
-                        if time.time() - self.file_timers[file_name] > self.file_timeout:
-                            print(
-                                f"File not found after 1 hour: {file_name}. Marking as failed and triggering a new search.")
-                            # Mark the release as failed in Sonarr or Radarr
-                            release_title = os.path.splitext(file_name)[0]  # Remove file extension
-                            search_and_mark_failed(release_title, None)  # Pass None for magnet_file_path since it's not available
-                            # Remove the file from the timers dictionary
-                            del self.file_timers[file_name]
-                        else:
-                            # If the file doesn't exist and the timeout hasn't been reached, put it back in the queue
-                            self.magnet_queue.put(item)
-                            print(f"File not found: {file_name}. Retrying later...")
-                    else:
-                        # If the file is found, remove it from the timers dictionary
-                        if file_name in self.file_timers:
-                            del self.file_timers[file_name]
+            # Sleep until the next torrent is due or a file it waits for appears on the mount
+            group = self.scheduler.pop_due()
+            if group is None:
+                continue
+            try:
+                with trace_job(group['infohash']):
+                    self.process_torrent(group)
+            except Exception as e:
+                print(f"Error processing {self.torrent_title(group)}: {e}")
+                self.retry_torrent(group)
+
+    def torrent_title(self, group):
+        """
+        Return the release name of a torrent, for logs and for reporting it as failed.
+        """
+        name = group['torrent_name']
+        if not name:
+            with self.waiting_lock:
+                name = os.path.basename(next(iter(group['jobs'].values()))['filename'])
+        base, extension = os.path.splitext(name)
+        return base if extension.lower() in VIDEO_EXTENSIONS else name
+
+    def retry_torrent(self, group):
+        """
+        Check a torrent again after its next backoff delay.
+        """
+        due = self.scheduler.backoff(group['key'], group)
+        with self.waiting_lock:
+            jobs = list(group['jobs'].values())
+        for job in jobs:
+            self.job_store.set_state(job['id'], WAITING_ON_MOUNT, next_check=due)
+
+    def process_torrent(self, group):
+        """
+        Import a torrent's files once all of them are on the rclone mount, otherwise reschedule it
+        or fail the whole torrent after the timeout.
+        """
+        with self.waiting_lock:
+            if group.get('copying'):
+                return  # Files that joined meanwhile are checked when the copy finishes
+            jobs = list(group['jobs'].values())
+        if not jobs:
+            self.unschedule_torrent(group)
+            return
+        expired = time.time() - group['first_seen'] > self.file_timeout
+
+        # Arrs set in DIRECT_DOWNLOAD get their files straight from Real-Debrid instead of the mount
+        if uses_direct_download(group['arr_folder']) and not expired:
+            self.start_import(group, jobs, lambda throttle: self.download_torrent(group, jobs, throttle))
+            return
+
+        paths = self.locate_files(group, jobs)
+        if len(paths) == len(jobs):
+            print(f"All {len(jobs)} files of {self.torrent_title(group)} found in rclone folder.")
+            MOUNT_WAIT_SECONDS.observe(time.time() - group['first_seen'])
+            self.start_import(group, jobs, lambda throttle: self.import_torrent(group, jobs, paths, throttle))
+
+        # Check if the torrent has been waiting for longer than the timeout
+        elif expired:
+            self.fail_torrent(group, jobs)
+
+        else:
+            # If some files aren't there and the timeout hasn't been reached, check again later
+            self.retry_torrent(group)
+            print(f"{len(jobs) - len(paths)} of {len(jobs)} files not found: {self.torrent_title(group)}. "
+                  f"Retrying later...")
+
+    def locate_files(self, group, jobs):
+        """
+        Return {job id: path on the mount} for the torrent's files that are on the mount.
+        Files are looked up in the mount index, only in the torrent's own folder when its name is
+        known (in any folder otherwise), so a same-named file of an older torrent is never imported.
+        If some are missing, the torrent folder is listed once and its files are added to the index,
+        so the whole pack is resolved without waiting for the next poll or re-sync.
+        """
+        folders = self.mount_folders(group)
+        with span("mount.lookup", files=len(jobs), retries=self.scheduler.attempts.get(group['key'], 0)) as trace:
+            paths = self.lookup_files(jobs, folders)
+            if len(paths) < len(jobs):
+                for folder in folders:
+                    try:
+                        listing = self.mount_source.list_folder(folder)
+                    except Exception as e:
+                        print(f"Error listing {folder} on the rclone mount: {e}")
+                        continue
+                    if listing:
+                        for file_name in listing:
+                            self.mount_index.add(os.path.join(self.rclone_folder, folder, file_name))
+                        paths = self.lookup_files(jobs, folders)
+                        break
+            trace.set(found=len(paths))
+        return paths
+
+    def lookup_files(self, jobs, folders):
+        paths = {}
+        for job in jobs:
+            path = self.mount_index.lookup(os.path.basename(job['filename']), folders)
+            if path:
+                paths[job['id']] = path
+        return paths
+
+    def start_import(self, group, jobs, function):
+        """
+        Queue function(throttle), which imports the given jobs of a torrent, on a copy slot.
+        """
+        with self.waiting_lock:
+            group['copying'] = True
+        for job in jobs:
+            self.job_store.set_state(job['id'], COPYING)
+        self.job_store.flush()
+        size = sum(job.get('size') or 0 for job in jobs) or None
+        self.copy_scheduler.submit(function, group['arr_folder'], size=size, created=group['first_seen'])
+
+    def finish_import(self, group, jobs, failed, rejected=()):
+        """
+        Stop tracking a torrent once all its files are imported, or check the failed ones again later.
+        The torrent fails if a file was rejected (it can never import) or failures go on past the timeout.
+        """
+        failed_ids = {job['id'] for job in [*failed, *rejected]}
+        with self.waiting_lock:
+            group['copying'] = False
+            for job in jobs:
+                if job['id'] not in failed_ids:
+                    group['jobs'].pop(job['id'], None)
+            remaining = list(group['jobs'].values())
+        if rejected:
+            self.fail_torrent(group, remaining, "has files that don't match Real-Debrid")
+        elif failed and time.time() - group['first_seen'] > self.file_timeout:
+            self.fail_torrent(group, remaining, "still failing to import after 1 hour")
+        elif failed:
+            self.retry_torrent(group)
+        elif remaining:
+            self.scheduler.schedule(group['key'], group)  # Files that joined while these were copied
+        else:
+            self.unschedule_torrent(group)
+
+    def fail_torrent(self, group, jobs, reason="not found after 1 hour"):
+        """
+        Fail the unfinished jobs of a torrent, e.g. because its files didn't all show up on the mount
+        in time, and report it once.
+        """
+        title = self.torrent_title(group)
+        print(f"Torrent {reason}: {title}. Marking as failed and triggering a new search.")
+        for job in jobs:
+            self.job_store.set_state(job['id'], FAILED)
+            # Remove the blank .mkv file so the arr doesn't import it
+            delete_blank_mkv_file(os.path.join(group['arr_folder'], job['filename']))
+        if group['infohash']:
+            self.job_store.record_torrent(group['infohash'], TORRENT_FAILED, group['torrent_id'],
+                                          group['torrent_name'])
+        self.unschedule_torrent(group)
+        # Mark the release as failed in Sonarr or Radarr.
+        # A placeholder's path picks the arr instance, since the magnet file is gone by now
+        search_and_mark_failed(title, os.path.join(group['arr_folder'], jobs[0]['filename']), group['infohash'])
+
+    def import_torrent(self, group, jobs, paths, throttle=None):
+        """
+        Import the files of a torrent from the mount one after another on a copy slot.
+        """
+        self.run_imports(group, jobs, lambda job: self.import_job(job, paths[job['id']], throttle))
 
-            time.sleep(5)  # Wait for 5 seconds before checking the queue again
+    def download_torrent(self, group, jobs, throttle=None):
+        """
+        Download the files of a torrent from Real-Debrid one after another on a copy slot.
+        """
+        self.run_imports(group, jobs, lambda job: self.download_job(job, throttle))
+
+    def run_imports(self, group, jobs, import_one):
+        """
+        Run import_one(job) for each job of a torrent, sorting out the ones to retry and the ones
+        whose source is the wrong size, then finish the torrent.
+        """
+        failed, rejected = [], []
+        for job in jobs:
+            try:
+                if not import_one(job):
+                    failed.append(job)
+            except SizeMismatchError as e:
+                print(f"Rejecting {job['filename']}: {e}")
+                rejected.append(job)
+        self.finish_import(group, jobs, failed, rejected)
+
+    def import_job(self, job, file_path, throttle=None):
+        """
+        Import a job's file from the mount. Returns whether it was imported; raises
+        SizeMismatchError if the file on the mount isn't the size Real-Debrid reports.
+        """
+        try:
+            with trace_job(job['infohash']), span("copy", file=job['filename'], size=job.get('size')):
+                # Import the actual file to the arr_folder, atomically replacing the blank .mkv file.
+                # A file that was already hash verified from the same torrent only gets the size checks,
+                # which keeps the kernel copy paths.
+                dst_file = os.path.join(job['arr_folder'], job['filename'])
+                checksum = self.job_store.verified_checksum(job['infohash'], job['filename'], job.get('size'))
+                verify = 'size' if checksum and copy_verify == 'hash' else copy_verify
+                checksum = import_file(file_path, dst_file, expected_size=job.get('size'), verify=verify,
+                                       throttle=throttle) or checksum
+        except SizeMismatchError:
+            raise
+        except Exception as e:
+            print(f"Error importing {job['filename']}: {e}")
+            return False
+        self.job_store.update(job['id'], state=DONE, checksum=checksum)
+        return True
+
+    def download_job(self, job, throttle=None):
+        """
+        Download a job's file from its Real-Debrid link. Returns whether it was downloaded; raises
+        SizeMismatchError if the link isn't the size Real-Debrid reported for the torrent file.
+        """
+        try:
+            with trace_job(job['infohash']), span("copy", file=job['filename'], size=job.get('size'), direct=True):
+                url, size = get_download_link(job['torrent_id'], job['filename'])
+                download_file(url, os.path.join(job['arr_folder'], job['filename']), size,
+                              expected_size=job.get('size'), throttle=throttle, verify=copy_verify)
+        except SizeMismatchError:
+            raise
+        except Exception as e:
+            print(f"Error downloading {job['filename']}: {e}")
+            return False
+        self.job_store.set_state(job['id'], DONE)
+        return True
 
     def stop_processing(self):
         """
         Stop the processing loop.
         """
-        self.running = False
\ No newline at end of file
+        self.running = False
+        self.mount_index.stop()
+        self.scheduler.stop()
+        self.copy_scheduler.stop()
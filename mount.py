@@ -0,0 +1,376 @@
+import os
+import re
+import threading
+import time
+from html import unescape
+from urllib.parse import quote, unquote
+import requests
+from dotenv import load_dotenv
+from watchdog.observers.polling import PollingObserver
+from metrics import MOUNT_LOOKUP_SECONDS, MOUNT_INDEX_BUILD_SECONDS
+
+load_dotenv()
+resync_interval = int(os.getenv('MOUNT_RESYNC_INTERVAL', 15 * 60))
+mount_watcher = os.getenv('MOUNT_WATCHER', 'targeted').lower()
+mount_poll_interval = float(os.getenv('MOUNT_POLL_INTERVAL', 5))
+rclone_rc_url = os.getenv('RCLONE_RC_URL', 'http://localhost:5572')
+rclone_rc_fs = os.getenv('RCLONE_RC_FS', 'zurg:')
+rclone_rc_user = os.getenv('RCLONE_RC_USER')
+rclone_rc_pass = os.getenv('RCLONE_RC_PASS')
+zurg_url = os.getenv('ZURG_URL', 'http://localhost:9999')
+zurg_directory = os.getenv('ZURG_DIRECTORY', '__all__')
+
+
+class MountIndex:
+    """
+    In-memory filename -> path index of the rclone mount.
+
+    The index is built with a single walk of the mount, kept current from the
+    watchdog events the RcloneFileHandler receives and re-synced periodically
+    in the background, so looking up a file never touches the FUSE mount.
+    """
+
+    def __init__(self, rclone_folder, resync_interval=resync_interval):
+        self.rclone_folder = rclone_folder
+        self.resync_interval = resync_interval
+        self._paths = {}  # filename -> set of full paths
+        self._lock = threading.Lock()
+        self._journal = []  # Events received while a build is walking the mount
+        self._ready = threading.Event()
+        self._resync_thread = None
+        self.running = True
+        self.on_added = []  # Callbacks called with (file_name, path) when a file is added
+        self.on_built = []  # Callbacks called after each full build
+
+    def build(self):
+        """
+        Walk the whole mount and swap in a fresh index.
+        Events that arrive during the walk are replayed on top of the new index.
+        """
+        with self._lock:
+            if self._journal is None:
+                self._journal = []
+
+        start = time.time()
+        paths = {}
+        for root, _, files in os.walk(self.rclone_folder):
+            for entry_name in files:
+                paths.setdefault(entry_name, set()).add(os.path.join(root, entry_name))
+
+        with self._lock:
+            journal, self._journal = self._journal, None
+            self._paths = paths
+            for op, path in journal:
+                op(path)
+
+        MOUNT_INDEX_BUILD_SECONDS.observe(time.time() - start)
+        self._ready.set()
+        for callback in self.on_built:
+            callback()
+        print(f"Indexed {len(paths)} filenames in rclone folder in {time.time() - start:.1f} seconds.")
+
+    def wait_ready(self, timeout=None):
+        """
+        Block until the first build has finished.
+        """
+        return self._ready.wait(timeout)
+
+    def lookup(self, file_name, folders=()):
+        """
+        Return a path on the mount for the given filename, or None if it isn't there.
+        If folders (e.g. the torrent's folder) are given, only a path in one of them is returned,
+        so a same-named file of another torrent is never matched.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            paths = self._paths.get(file_name)
+            path = None
+            if paths and folders:
+                path = next((p for p in paths if os.path.basename(os.path.dirname(p)) in folders), None)
+            elif paths:
+                path = next(iter(paths))
+        MOUNT_LOOKUP_SECONDS.observe(time.perf_counter() - start)
+        return path
+
+    def add(self, path):
+        """
+        Record a file that appeared on the mount.
+        """
+        self._apply(self._add, path)
+        for callback in self.on_added:
+            callback(os.path.basename(path), path)
+
+    def remove(self, path):
+        """
+        Forget a file that disappeared from the mount.
+        """
+        self._apply(self._remove, path)
+
+    def add_directory(self, path):
+        """
+        Record every file below a directory that appeared on the mount.
+        """
+        for root, _, files in os.walk(path):
+            for entry_name in files:
+                self.add(os.path.join(root, entry_name))
+
+    def remove_directory(self, path):
+        """
+        Forget every file below a directory that disappeared from the mount.
+        """
+        self._apply(self._remove_prefix, path)
+
+    def _apply(self, op, path):
+        with self._lock:
+            op(path)
+            if self._journal is not None:
+                self._journal.append((op, path))
+
+    # The underscored operations expect self._lock to be held.
+    def _add(self, path):
+        self._paths.setdefault(os.path.basename(path), set()).add(path)
+
+    def _remove(self, path):
+        file_name = os.path.basename(path)
+        paths = self._paths.get(file_name)
+        if paths:
+            paths.discard(path)
+            if not paths:
+                del self._paths[file_name]
+
+    def _remove_prefix(self, path):
+        prefix = os.path.join(path, '')
+        for file_name in list(self._paths):
+            paths = self._paths[file_name]
+            paths.difference_update([p for p in paths if p.startswith(prefix)])
+            if not paths:
+                del self._paths[file_name]
+
+    def start(self):
+        """
+        Build the index in the background and keep re-syncing it every resync_interval seconds.
+        """
+        self._resync_thread = threading.Thread(target=self._resync_loop, daemon=True)
+        self._resync_thread.start()
+
+    def _resync_loop(self):
+        while self.running:
+            try:
+                self.build()
+            except Exception as e:
+                print(f"Error indexing rclone folder: {e}")
+            deadline = time.time() + self.resync_interval
+            while self.running and time.time() < deadline:
+                time.sleep(1)
+
+    def stop(self):
+        """
+        Stop the background re-sync.
+        """
+        self.running = False
+
+
+def list_mount_folder(rclone_folder, name):
+    """
+    Return the file names in a torrent folder on the FUSE mount, or None if the folder doesn't exist.
+    """
+    try:
+        with os.scandir(os.path.join(rclone_folder, name)) as entries:
+            return {entry.name for entry in entries if not entry.is_dir()}
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class FullPollSource:
+    """
+    Detect mount changes with watchdog's PollingObserver, which stats the whole mount on every poll.
+    Kept as a fallback for mounts the targeted sources can't handle.
+    """
+
+    def __init__(self, handler, rclone_folder):
+        self.rclone_folder = rclone_folder
+        self.observer = PollingObserver()
+        self.observer.schedule(handler, rclone_folder, recursive=True)
+
+    def watch(self, name):
+        pass
+
+    def unwatch(self, name):
+        pass
+
+    def list_folder(self, name):
+        return list_mount_folder(self.rclone_folder, name)
+
+    def start(self):
+        self.observer.start()
+
+    def stop(self):
+        self.observer.stop()
+
+    def join(self):
+        self.observer.join()
+
+
+class TargetedPollSource:
+    """
+    Detect mount changes by listing only the torrent folders that jobs are waiting on.
+
+    Every poll_interval seconds each watched folder is listed and compared with the previous
+    listing; new and removed files are applied to the mount index. Idle cost is zero and the
+    cost of a poll depends on the number of waiting torrents, not on the size of the library.
+    Subclasses list folders through an API instead of the FUSE mount.
+    """
+
+    def __init__(self, handler, rclone_folder, poll_interval=mount_poll_interval):
+        self.mount_index = handler.mount_index
+        self.rclone_folder = rclone_folder
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.targets = {}  # folder name -> number of jobs waiting on it
+        self.listings = {}  # folder name -> file names seen in the last poll
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._poll_loop, daemon=True)
+
+    def watch(self, name):
+        """
+        Start listing a torrent folder on every poll.
+        """
+        with self.lock:
+            self.targets[name] = self.targets.get(name, 0) + 1
+
+    def unwatch(self, name):
+        """
+        Stop listing a torrent folder once no job waits on it any more.
+        """
+        with self.lock:
+            self.targets[name] = self.targets.get(name, 1) - 1
+            if self.targets[name] <= 0:
+                del self.targets[name]
+                self.listings.pop(name, None)
+
+    def list_folder(self, name):
+        """
+        Return the file names in a torrent folder, or None if the folder doesn't exist.
+        """
+        return list_mount_folder(self.rclone_folder, name)
+
+    def poll(self):
+        """
+        List every watched folder once and apply the differences to the mount index.
+        """
+        with self.lock:
+            names = list(self.targets)
+        for name in names:
+            try:
+                files = self.list_folder(name)
+            except Exception as e:
+                print(f"Error listing {name} on the rclone mount: {e}")
+                continue
+            files = files or set()
+            with self.lock:
+                if name not in self.targets:
+                    continue
+                previous = self.listings.get(name, set())
+                self.listings[name] = files
+            folder = os.path.join(self.rclone_folder, name)
+            for file_name in files - previous:
+                self.mount_index.add(os.path.join(folder, file_name))
+            for file_name in previous - files:
+                self.mount_index.remove(os.path.join(folder, file_name))
+
+    def _poll_loop(self):
+        while not self.stop_event.wait(self.poll_interval):
+            self.poll()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self):
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+class RcloneRCSource(TargetedPollSource):
+    """
+    List watched torrent folders through rclone's remote control API instead of the FUSE mount.
+    Each folder's VFS directory cache is refreshed first, so new files show up without waiting
+    for the dir-cache-time to expire.
+    """
+
+    def __init__(self, handler, rclone_folder, poll_interval=mount_poll_interval, rc_url=rclone_rc_url,
+                 rc_fs=rclone_rc_fs, rc_user=rclone_rc_user, rc_pass=rclone_rc_pass):
+        super().__init__(handler, rclone_folder, poll_interval)
+        self.rc_url = rc_url.rstrip('/')
+        self.rc_fs = rc_fs
+        # The rclone folder is usually a subfolder of the remote, e.g. zurg's __all__
+        self.rc_prefix = os.path.basename(os.path.normpath(rclone_folder))
+        self.session = requests.Session()
+        if rc_user:
+            self.session.auth = (rc_user, rc_pass or '')
+
+    def _rc(self, command, **params):
+        response = self.session.post(f"{self.rc_url}/{command}", json=params, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def list_folder(self, name):
+        remote = f"{self.rc_prefix}/{name}" if self.rc_prefix else name
+        try:
+            self._rc("vfs/refresh", dir=remote)
+        except requests.exceptions.HTTPError:
+            pass  # The folder isn't in the VFS yet
+        try:
+            listing = self._rc("operations/list", fs=self.rc_fs, remote=remote)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+        return {item["Name"] for item in listing.get("list", []) if not item.get("IsDir")}
+
+
+class ZurgSource(TargetedPollSource):
+    """
+    List watched torrent folders through zurg's HTTP library listing instead of the FUSE mount.
+    """
+
+    LINK_PATTERN = re.compile(r'href="([^"]+)"')
+
+    def __init__(self, handler, rclone_folder, poll_interval=mount_poll_interval, url=zurg_url,
+                 directory=zurg_directory):
+        super().__init__(handler, rclone_folder, poll_interval)
+        self.url = url.rstrip('/')
+        self.directory = directory
+        self.session = requests.Session()
+
+    def list_folder(self, name):
+        response = self.session.get(f"{self.url}/http/{quote(self.directory)}/{quote(name)}/", timeout=30)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        files = set()
+        for href in self.LINK_PATTERN.findall(response.text):
+            file_name = unquote(unescape(href)).rstrip('/').rsplit('/', 1)[-1]
+            if href.endswith('/') or not file_name or file_name in ('.', '..'):
+                continue
+            files.add(file_name)
+        return files
+
+
+MOUNT_SOURCES = {
+    'poll': FullPollSource,
+    'targeted': TargetedPollSource,
+    'rclone': RcloneRCSource,
+    'zurg': ZurgSource,
+}
+
+
+def create_mount_source(handler, rclone_folder, kind=mount_watcher):
+    """
+    Create the mount change source selected by MOUNT_WATCHER.
+    """
+    if kind not in MOUNT_SOURCES:
+        raise ValueError(f"Unknown mount watcher '{kind}'. Expected one of: {', '.join(MOUNT_SOURCES)}.")
+    return MOUNT_SOURCES[kind](handler, rclone_folder)
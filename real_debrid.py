@@ -1,25 +1,552 @@
 import os
+import random
+import threading
 import time
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from arrs import search_and_mark_failed
-from torrents import delete_file_with_retry
+from torrents import delete_file_with_retry, get_infohash
+from metrics import RD_REQUESTS, RD_LATENCY
+from tracing import span
 
 load_dotenv()
 rd_api_token = os.getenv('RD_APITOKEN')
-base_url = "https://api.real-debrid.com/rest/1.0"
+base_url = os.getenv('RD_BASE_URL', "https://api.real-debrid.com/rest/1.0")
+rd_requests_per_minute = int(os.getenv('RD_REQUESTS_PER_MINUTE', 250))
+rd_max_retries = int(os.getenv('RD_MAX_RETRIES', 5))
+rd_cache_check = os.getenv('RD_CACHE_CHECK', 'True').lower() == 'true'
+rd_cache_check_ttl = int(os.getenv('RD_CACHE_CHECK_TTL', 15 * 60))
+rd_status_min_interval = float(os.getenv('RD_STATUS_MIN_INTERVAL', 2))
+rd_status_max_interval = float(os.getenv('RD_STATUS_MAX_INTERVAL', 30))
+rd_library_index = os.getenv('RD_LIBRARY_INDEX', 'True').lower() == 'true'
+rd_library_refresh_interval = float(os.getenv('RD_LIBRARY_REFRESH_INTERVAL', 60))
+rd_library_full_refresh_interval = float(os.getenv('RD_LIBRARY_FULL_REFRESH_INTERVAL', 60 * 60))
 
 
 # List of video file extensions
 VIDEO_EXTENSIONS = [".mp4", ".mkv", ".avi", ".mov", ".wmv", ".flv", ".m4v"]
 
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that spreads requests evenly over a per-minute cap.
+    """
+
+    def __init__(self, rate_per_minute, capacity=10):
+        self.rate = rate_per_minute / 60.0  # Tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class RealDebridClient:
+    """
+    Shared Real-Debrid API client.
+
+    All calls go through one keep-alive Session, are rate limited across threads by a
+    token bucket, and are retried with jittered exponential backoff on 429 and 5xx
+    responses or connection errors. Latency is recorded per endpoint.
+
+    POSTs are not idempotent by default (e.g. a torrents/addMagnet that timed out may still
+    have added the torrent), so they are only retried on 429 or when the connection couldn't
+    be made; pass idempotent=True for calls that are safe to repeat.
+    """
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_token, base_url=base_url, requests_per_minute=rd_requests_per_minute,
+                 max_retries=rd_max_retries, backoff_base=1, backoff_max=60, pool_size=16, timeout=30):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.limiter = TokenBucket(requests_per_minute)
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_token}"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.stats_lock = threading.Lock()
+        self.latency = {}  # "METHOD endpoint" -> {"count", "errors", "total", "max"}
+
+    def request(self, method, endpoint, *path_args, idempotent=None, **kwargs):
+        """
+        Send a request to base_url/endpoint[/path_args...] and return the response.
+        Latency is recorded under the endpoint name, without the path arguments.
+        idempotent defaults to False for POSTs and True otherwise.
+        """
+        if idempotent is None:
+            idempotent = method != "POST"
+        with span("rd.request", method=method, endpoint=endpoint) as trace:
+            response = self._request(method, endpoint, path_args, kwargs, idempotent)
+            trace.set(status=response.status_code)
+            return response
+
+    def _request(self, method, endpoint, path_args, kwargs, idempotent=True):
+        url = "/".join([self.base_url, endpoint, *map(str, path_args)])
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(method, endpoint, time.monotonic() - start, 'error', error=True)
+                if attempt >= self.max_retries or not (idempotent or self._not_sent(e)):
+                    raise
+                delay = self._backoff(attempt)
+                print(f"Real-Debrid {endpoint} request failed ({e}). Retrying in {delay:.1f} seconds...")
+            else:
+                retry = response.status_code == 429 or (idempotent and response.status_code in self.RETRY_STATUS_CODES)
+                self._record(method, endpoint, time.monotonic() - start, response.status_code, error=retry)
+                if not retry or attempt >= self.max_retries:
+                    return response
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                print(f"Real-Debrid {endpoint} returned {response.status_code}. Retrying in {delay:.1f} seconds...")
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, endpoint, *path_args, **kwargs):
+        return self.request("GET", endpoint, *path_args, **kwargs)
+
+    def post(self, endpoint, *path_args, **kwargs):
+        return self.request("POST", endpoint, *path_args, **kwargs)
+
+    def delete(self, endpoint, *path_args, **kwargs):
+        return self.request("DELETE", endpoint, *path_args, **kwargs)
+
+    @staticmethod
+    def _not_sent(error):
+        """
+        Return whether a request failed before it reached Real-Debrid, so it can't have been applied.
+        """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _backoff(self, attempt, retry_after=None):
+        """
+        Full-jitter exponential backoff, never shorter than a Retry-After header.
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def _record(self, method, endpoint, elapsed, status, error=False):
+        key = f"{method} {endpoint}"
+        RD_REQUESTS.inc(key, status)
+        RD_LATENCY.observe(elapsed, key)
+        with self.stats_lock:
+            stats = self.latency.setdefault(key, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+
+    def stats(self):
+        """
+        Return a snapshot of the per-endpoint latency counters.
+        """
+        with self.stats_lock:
+            return {key: dict(value) for key, value in self.latency.items()}
+
+
+class InstantAvailabilityCache:
+    """
+    TTL cache of Real-Debrid instant availability, keyed by lowercase infohash.
+
+    Lookups are made in batches of up to batch_size hashes per request. Concurrent
+    is_cached() calls that arrive within batch_window seconds of each other share one
+    request. A result of None means availability is unknown (request failed or the
+    endpoint is unavailable) and the caller should fall back to adding the torrent.
+    """
+
+    def __init__(self, client, ttl=rd_cache_check_ttl, batch_size=50, batch_window=0.2, enabled=rd_cache_check):
+        self.client = client
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.enabled = enabled
+        self.cache = {}  # infohash -> (cached, expires)
+        self.pending = set()  # Hashes waiting for the next coalesced batch
+        self.flush_scheduled = False
+        self.condition = threading.Condition()
+
+    def _get(self, infohash):
+        # Expects self.condition to be held
+        entry = self.cache.get(infohash)
+        if entry and entry[1] > time.monotonic():
+            return entry
+        return None
+
+    def check(self, infohashes):
+        """
+        Return {infohash: True/False/None} for the given hashes, querying Real-Debrid
+        in batches only for hashes that aren't in the cache.
+        """
+        infohashes = [h.lower() for h in infohashes if h]
+        with self.condition:
+            missing = list(dict.fromkeys(h for h in infohashes if not self._get(h)))
+        for i in range(0, len(missing), self.batch_size):
+            self._fetch(missing[i:i + self.batch_size])
+        with self.condition:
+            return {h: (self._get(h) or (None,))[0] for h in infohashes}
+
+    def is_cached(self, infohash):
+        """
+        Return whether a single infohash is cached on Real-Debrid, coalescing
+        concurrent callers into one batched request.
+        """
+        if not self.enabled or not infohash:
+            return None
+        infohash = infohash.lower()
+        with self.condition:
+            entry = self._get(infohash)
+            if entry:
+                return entry[0]
+            self.pending.add(infohash)
+            if self.flush_scheduled:
+                # Another caller is collecting a batch; wait for it to be answered
+                while infohash in self.pending:
+                    self.condition.wait()
+                return (self._get(infohash) or (None,))[0]
+            self.flush_scheduled = True
+
+        # This caller leads the batch: give other callers a moment to join it
+        time.sleep(self.batch_window)
+        with self.condition:
+            batch, self.pending = list(self.pending), set()
+            self.flush_scheduled = False
+        try:
+            for i in range(0, len(batch), self.batch_size):
+                self._fetch(batch[i:i + self.batch_size])
+        finally:
+            with self.condition:
+                self.condition.notify_all()
+        with self.condition:
+            return (self._get(infohash) or (None,))[0]
+
+    def _fetch(self, infohashes):
+        """
+        Query Real-Debrid for one batch of hashes and store the results.
+        """
+        if not self.enabled or not infohashes:
+            return
+        try:
+            response = self.client.get("torrents/instantAvailability", *infohashes)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to check instant availability: {e}")
+            return
+        if response.status_code != 200:
+            print(f"Failed to check instant availability: {response.text}")
+            try:
+                if response.json().get("error") == "disabled_endpoint":
+                    print("Instant availability is disabled on Real-Debrid. Skipping cache checks.")
+                    self.enabled = False
+            except ValueError:
+                pass
+            return
+
+        availability = {key.lower(): value for key, value in response.json().items()}
+        expires = time.monotonic() + self.ttl
+        with self.condition:
+            for infohash in infohashes:
+                if infohash not in availability:
+                    continue  # Unknown; leave it to the addMagnet path
+                hosters = availability[infohash]
+                cached = isinstance(hosters, dict) and bool(hosters.get("rd"))
+                self.cache[infohash] = (cached, expires)
+
+
+class TorrentStatusTracker:
+    """
+    Tracks the status of every torrent being waited on with one poll of the paginated
+    /torrents list, instead of a torrents/info call per torrent.
+
+    The list is paged newest first and paging stops once every tracked torrent is found,
+    so one request usually covers all of them. The poll interval adapts to the slowest
+    useful rate: short while torrents are changing state, about half the shortest ETA
+    while they download, and backing off towards max_interval when nothing moves.
+    """
+
+    FINAL_STATUSES = {"downloaded", "error", "dead", "magnet_error", "virus"}
+    # Statuses that usually change within seconds
+    BUSY_STATUSES = {"magnet_conversion", "waiting_files_selection", "queued", "compressing", "uploading"}
+
+    def __init__(self, client, min_interval=rd_status_min_interval, max_interval=rd_status_max_interval,
+                 page_size=100):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.page_size = page_size
+        self.interval = min_interval
+        self.waiters = {}  # torrent id -> number of threads waiting on it
+        self.torrents = {}  # torrent id -> torrent as last seen in the list
+        self.next_poll = 0
+        self.thread = None
+        self.condition = threading.Condition()
+        self.on_torrents = []  # Callbacks given each page of the torrent list that is fetched
+
+    def wait(self, torrent_id, stop_event=None):
+        """
+        Block until a torrent reaches a final status and return it as listed by Real-Debrid.
+        Returns None if stop_event is set first.
+        """
+        with self.condition:
+            self.waiters[torrent_id] = self.waiters.get(torrent_id, 0) + 1
+            # Check a new torrent soon, without polling once per torrent in a burst
+            self.next_poll = min(self.next_poll, time.monotonic() + self.min_interval)
+            if self.thread is None:
+                self.next_poll = time.monotonic() + self.min_interval
+                self.thread = threading.Thread(target=self._poll_loop, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+            try:
+                while True:
+                    torrent = self.torrents.get(torrent_id)
+                    if torrent and torrent.get("status") in self.FINAL_STATUSES:
+                        return torrent
+                    if stop_event and stop_event.is_set():
+                        return None
+                    self.condition.wait(1)
+            finally:
+                self.waiters[torrent_id] -= 1
+                if not self.waiters[torrent_id]:
+                    del self.waiters[torrent_id]
+                    self.torrents.pop(torrent_id, None)
+
+    def _poll_loop(self):
+        while True:
+            with self.condition:
+                while self.waiters and time.monotonic() < self.next_poll:
+                    self.condition.wait(self.next_poll - time.monotonic())
+                if not self.waiters:
+                    self.thread = None
+                    return
+                wanted = set(self.waiters)
+
+            try:
+                torrents = self._poll(wanted)
+            except Exception as e:
+                print(f"Failed to poll torrent status: {e}")
+                torrents = {}
+            self.interval = self._next_interval(torrents)
+
+            with self.condition:
+                for torrent_id, torrent in torrents.items():
+                    if torrent_id in self.waiters:
+                        self.torrents[torrent_id] = torrent
+                self.next_poll = time.monotonic() + self.interval
+                self.condition.notify_all()
+
+    def _poll(self, wanted):
+        """
+        Page through /torrents until every wanted torrent is found and return {id: torrent}.
+        Torrents missing from the list are looked up individually.
+        """
+        found = {}
+        page = 1
+        while len(found) < len(wanted):
+            response = self.client.get("torrents", params={"page": page, "limit": self.page_size})
+            if response.status_code == 204:
+                break  # Past the last page
+            if response.status_code != 200:
+                raise Exception(f"Failed to list torrents: {response.text}")
+            torrents = response.json()
+            for callback in self.on_torrents:
+                callback(torrents)
+            for torrent in torrents:
+                if torrent["id"] in wanted:
+                    found[torrent["id"]] = torrent
+            if len(torrents) < self.page_size:
+                break
+            page += 1
+
+        for torrent_id in wanted - set(found):
+            response = self.client.get("torrents/info", torrent_id)
+            if response.status_code == 200:
+                found[torrent_id] = response.json()
+            elif response.status_code == 404:
+                print(f"Torrent {torrent_id} is no longer on Real-Debrid.")
+                found[torrent_id] = {"id": torrent_id, "status": "dead"}
+        return found
+
+    def _next_interval(self, torrents):
+        """
+        Pick the delay before the next poll from the progress of the tracked torrents.
+        """
+        intervals = []
+        for torrent in torrents.values():
+            status = torrent.get("status")
+            if status in self.FINAL_STATUSES:
+                continue
+            if status in self.BUSY_STATUSES:
+                intervals.append(self.min_interval)
+            elif status == "downloading" and torrent.get("speed"):
+                remaining = torrent.get("bytes", 0) * (100 - torrent.get("progress", 0)) / 100
+                intervals.append(remaining / torrent["speed"] / 2)
+            else:
+                intervals.append(self.interval * 2)  # Stalled or no ETA; back off
+        if not intervals:
+            return self.min_interval
+        return max(self.min_interval, min(self.max_interval, min(intervals)))
+
+
+class TorrentLibrary:
+    """
+    In-memory index of the torrents already in the Real-Debrid account, keyed by lowercase infohash.
+
+    The whole library is loaded with a few large pages of the /torrents list. Lookups
+    refresh it at most every refresh_interval seconds, fetching only the newest pages
+    until a known torrent is reached, and reload it fully every full_refresh_interval
+    seconds or when the account holds fewer torrents than indexed (torrents were deleted).
+    """
+
+    def __init__(self, client, enabled=rd_library_index, refresh_interval=rd_library_refresh_interval,
+                 full_refresh_interval=rd_library_full_refresh_interval, page_size=1000, refresh_page_size=100):
+        self.client = client
+        self.enabled = enabled
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.page_size = page_size
+        self.refresh_page_size = refresh_page_size
+        self.by_hash = {}  # infohash -> torrent as listed
+        self.by_id = {}  # torrent id -> infohash
+        self.loaded = 0  # Monotonic time of the last full load
+        self.refreshed = 0  # Monotonic time of the last refresh of any kind
+        self.lock = threading.Lock()  # Held while fetching, so concurrent lookups share one refresh
+        self.index_lock = threading.Lock()
+
+    def update(self, torrents):
+        """
+        Add or update torrents from a page of the torrent list.
+        """
+        with self.index_lock:
+            for torrent in torrents:
+                if torrent.get("hash"):
+                    infohash = torrent["hash"].lower()
+                    self.by_hash[infohash] = torrent
+                    self.by_id[torrent["id"]] = infohash
+
+    def remove(self, torrent_id):
+        """
+        Forget a torrent that was deleted from the account.
+        """
+        with self.index_lock:
+            infohash = self.by_id.pop(torrent_id, None)
+            if infohash and self.by_hash.get(infohash, {}).get("id") == torrent_id:
+                del self.by_hash[infohash]
+
+    def _fetch_page(self, page, limit):
+        """
+        Return (torrents, total count) for one page of the torrent list.
+        """
+        response = self.client.get("torrents", params={"page": page, "limit": limit})
+        if response.status_code == 204:
+            return [], None
+        if response.status_code != 200:
+            raise Exception(f"Failed to list torrents: {response.text}")
+        total = response.headers.get("X-Total-Count")
+        return response.json(), int(total) if total else None
+
+    def load(self):
+        """
+        Load the whole library, replacing the index.
+        """
+        start = time.monotonic()
+        by_hash, by_id = {}, {}
+        page = 1
+        while True:
+            torrents, _ = self._fetch_page(page, self.page_size)
+            for torrent in torrents:
+                if torrent.get("hash"):
+                    by_hash.setdefault(torrent["hash"].lower(), torrent)  # Newest entry wins
+                    by_id[torrent["id"]] = torrent["hash"].lower()
+            if len(torrents) < self.page_size:
+                break
+            page += 1
+        with self.index_lock:
+            self.by_hash, self.by_id = by_hash, by_id
+        self.loaded = self.refreshed = time.monotonic()
+        print(f"Indexed {len(by_hash)} torrents in the Real-Debrid library in {self.refreshed - start:.1f} seconds.")
+
+    def refresh(self):
+        """
+        Fetch the newest pages of the library until a torrent that is already indexed is reached.
+        """
+        page = 1
+        while True:
+            torrents, total = self._fetch_page(page, self.refresh_page_size)
+            with self.index_lock:
+                known = any(torrent["id"] in self.by_id for torrent in torrents)
+                indexed = len(self.by_id)
+            if page == 1 and total is not None and total < indexed:
+                self.load()  # Torrents were deleted from the account
+                return
+            self.update(torrents)
+            if known or len(torrents) < self.refresh_page_size:
+                break
+            page += 1
+        self.refreshed = time.monotonic()
+
+    def lookup(self, infohash):
+        """
+        Return the torrent in the library with the given infohash, or None.
+        """
+        if not self.enabled or not infohash:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            try:
+                if not self.loaded or now - self.loaded > self.full_refresh_interval:
+                    self.load()
+                elif now - self.refreshed > self.refresh_interval:
+                    self.refresh()
+            except Exception as e:
+                print(f"Failed to refresh the Real-Debrid library index: {e}")
+        with self.index_lock:
+            return self.by_hash.get(infohash.lower())
+
+
+rd_client = RealDebridClient(rd_api_token)
+instant_availability = InstantAvailabilityCache(rd_client)
+status_tracker = TorrentStatusTracker(rd_client)
+rd_library = TorrentLibrary(rd_client)
+# Statuses seen while waiting on downloads keep the library index fresh for free
+status_tracker.on_torrents.append(rd_library.update)
+
 def get_torrent_info(torrent_id):
     """
     Get the filename and ID of the torrent.
     """
-    torrent_info_url = f"{base_url}/torrents/info/{torrent_id}"
-    headers = {"Authorization": f"Bearer {rd_api_token}"}
-    response = requests.get(torrent_info_url, headers=headers)
+    response = rd_client.get("torrents/info", torrent_id)
 
     if response.status_code != 200:
         raise Exception(f"Failed to get torrent info: {response.text}")
@@ -31,19 +558,90 @@ def remove_torrent(torrent_id):
     """
     Remove the torrent from Real-Debrid.
     """
-    delete_url = f"{base_url}/torrents/delete/{torrent_id}"
-    headers = {"Authorization": f"Bearer {rd_api_token}"}
-    response = requests.delete(delete_url, headers=headers)
+    response = rd_client.delete("torrents/delete", torrent_id)
 
     if response.status_code != 204:
         raise Exception(f"Failed to remove torrent: {response.text}")
 
+    rd_library.remove(torrent_id)
     print(f"Torrent {torrent_id} removed from Real-Debrid.")
 
-def upload_magnet_to_realdebrid(magnet_link, magnet_file_path=None):
+def get_video_files(torrent_info, selected_only=False):
+    """
+    Return [(file id, file name, size in bytes)] of the video files of a torrent, leaving out samples.
+    """
+    video_files = []
+    for file in torrent_info.get("files") or []:
+        if selected_only and not file.get("selected"):
+            continue
+        file_name = file["path"].lstrip('/')
+        file_name_lower = file_name.lower()
+        if any(file_name_lower.endswith(ext) for ext in VIDEO_EXTENSIONS) and "sample" not in file_name_lower:
+            video_files.append((str(file["id"]), file_name, file.get("bytes")))
+    return video_files
+
+def get_download_link(torrent_id, file_name):
+    """
+    Unrestrict the Real-Debrid link of one file of a downloaded torrent.
+    Returns (download url, size in bytes).
+    """
+    torrent_info = get_torrent_info(torrent_id)
+    # Real-Debrid lists one link per selected file, in file order
+    selected = [file for file in sorted(torrent_info.get("files") or [], key=lambda f: f["id"]) if file.get("selected")]
+    links = torrent_info.get("links") or []
+    for file, link in zip(selected, links):
+        if file["path"].lstrip('/') == file_name:
+            break
+    else:
+        raise Exception(f"No download link for {file_name} in torrent {torrent_id}")
+
+    response = rd_client.post("unrestrict/link", data={"link": link}, idempotent=True)
+    if response.status_code != 200:
+        raise Exception(f"Failed to unrestrict link: {response.text}")
+    unrestricted = response.json()
+    return unrestricted["download"], int(unrestricted.get("filesize") or file["bytes"])
+
+def reuse_library_torrent(torrent, stop_event=None):
+    """
+    Return the upload result for a torrent that is already in the library, waiting for it
+    to finish downloading if needed. Returns None if it can't be reused.
+    """
+    response = rd_client.get("torrents/info", torrent["id"])
+    if response.status_code == 404:
+        rd_library.remove(torrent["id"])
+        return None
+    if response.status_code != 200:
+        raise Exception(f"Failed to get torrent info: {response.text}")
+    torrent_info = response.json()
+    video_files = get_video_files(torrent_info, selected_only=True)
+    if not video_files or torrent_info["status"] in TorrentStatusTracker.FINAL_STATUSES - {"downloaded"}:
+        return None
+    if torrent_info["status"] != "downloaded":
+        print(f"Torrent {torrent['id']} is already in the library. Waiting for it to download...")
+        with span("rd.wait", torrent_id=torrent["id"]) as trace:
+            listed = status_tracker.wait(torrent["id"], stop_event)
+            trace.set(status=listed and listed["status"])
+        if listed is None or listed["status"] != "downloaded":
+            return None
+    for _, file_name, _ in video_files:
+        print(f"Video file found: {file_name}")
+    return {
+        "id": torrent_info["id"],
+        "name": torrent_info.get("filename"),
+        "filename": [file_name for _, file_name, _ in video_files],
+        "sizes": [size for _, _, size in video_files]
+    }
+
+def upload_magnet_to_realdebrid(magnet_link, magnet_file_path=None, stop_event=None, delete_magnet_file=True,
+                                on_added=None):
     """
     Upload a magnet link to Real-Debrid, select only video files for download,
     and handle cases where the torrent is not cached.
+    If stop_event is set while waiting for the download, give up and return None.
+    Pass delete_magnet_file=False to keep the .magnet file once the torrent is downloaded,
+    e.g. until the caller has saved its jobs.
+    on_added is called with the torrent id as soon as the magnet is added, so the caller
+    can save it and resume waiting on that torrent after a restart.
     """
 
     # Step 0: Validate the magnet link
@@ -55,11 +653,36 @@ def upload_magnet_to_realdebrid(magnet_link, magnet_file_path=None):
             delete_file_with_retry(file_path=magnet_file_path)
         return None
 
+    # Step 0a: Reuse the torrent if it is already in the Real-Debrid library
+    infohash = get_infohash(magnet_link)
+    with span("rd.library_lookup") as trace:
+        torrent = rd_library.lookup(infohash)
+        trace.set(found=bool(torrent))
+    if torrent:
+        print(f"Torrent {infohash} is already in the Real-Debrid library as {torrent['id']}. Reusing it.")
+        result = reuse_library_torrent(torrent, stop_event)
+        if result:
+            if delete_magnet_file and magnet_file_path and os.path.exists(magnet_file_path):
+                delete_file_with_retry(magnet_file_path)
+            return result
+        if stop_event and stop_event.is_set():
+            return None
+        print(f"Torrent {torrent['id']} can't be reused. Adding the magnet again.")
+
+    # Step 0b: Check if the torrent is cached before adding it to the library
+    with span("rd.cache_check") as trace:
+        cached = instant_availability.is_cached(infohash)
+        trace.set(cached=cached)
+    if cached is False:
+        print("Torrent is not cached on Real-Debrid. Skipping upload.")
+        if magnet_file_path:
+            release_title = os.path.basename(magnet_file_path).replace(".magnet", "").replace(".torrent", "")
+            search_and_mark_failed(release_title, magnet_file_path, infohash)
+        return None
+
     # Step 1: Add the magnet link
-    add_magnet_url = f"{base_url}/torrents/addMagnet"
-    headers = {"Authorization": f"Bearer {rd_api_token}"}
     data = {"magnet": magnet_link}
-    response = requests.post(add_magnet_url, headers=headers, data=data)
+    response = rd_client.post("torrents/addMagnet", data=data)
 
     if response.status_code != 201:
         error_data = response.json()
@@ -67,14 +690,17 @@ def upload_magnet_to_realdebrid(magnet_link, magnet_file_path=None):
             print("Torrent contains infringing content. Marking as failed and triggering a new search.")
             if magnet_file_path:
                 release_title = os.path.basename(magnet_file_path).replace(".magnet", "").replace(".torrent", "")
-                search_and_mark_failed(release_title, magnet_file_path)
+                search_and_mark_failed(release_title, magnet_file_path, infohash)
                 delete_file_with_retry(file_path=magnet_file_path)
             return None
         else:
             raise Exception(f"Failed to add magnet link: {response.text}")
 
     torrent_id = response.json()["id"]
+    rd_library.update([{"id": torrent_id, "hash": infohash, "status": "magnet_conversion"}])
     print(f"Magnet link added. Torrent ID: {torrent_id}")
+    if on_added:
+        on_added(torrent_id)
 
     # Step 2: Get torrent info to list files
     torrent_info = get_torrent_info(torrent_id)
@@ -82,32 +708,35 @@ def upload_magnet_to_realdebrid(magnet_link, magnet_file_path=None):
     # Step 3: Filter video files
     video_files = []
     video_files_names = []
+    video_files_sizes = []
     if "files" in torrent_info and torrent_info["files"]:
-        for file in torrent_info["files"]:
-            file_name = file["path"].lstrip('/')
-            file_name_lower = file_name.lower()
-            if any(file_name_lower.endswith(ext) for ext in VIDEO_EXTENSIONS) and "sample" not in file_name_lower:
-                video_files.append(str(file["id"]))  # Convert ID to string
-                video_files_names.append(file_name)
-                print(f"Video file found: {file['path']}")
+        for file_id, file_name, size in get_video_files(torrent_info):
+            video_files.append(file_id)
+            video_files_names.append(file_name)
+            video_files_sizes.append(size)
+            print(f"Video file found: {file_name}")
     else:
         print("No files found in the torrent or 'files' key is missing.")
 
     if not video_files:
         print("No video files found in the torrent.")
+        remove_torrent(torrent_id)
+        # Mark the release as failed in Sonarr or Radarr
+        if magnet_file_path:
+            release_title = os.path.basename(magnet_file_path).replace(".magnet", "").replace(".torrent", "")
+            search_and_mark_failed(release_title, magnet_file_path, infohash)
         return None
 
     # Step 4: Select only video files for download
-    select_files_url = f"{base_url}/torrents/selectFiles/{torrent_id}"
     files_data = {"files": ",".join(video_files)}  # Select only video files
-    response = requests.post(select_files_url, headers=headers, data=files_data)
+    response = rd_client.post("torrents/selectFiles", torrent_id, data=files_data, idempotent=True)
 
     if response.status_code != 204:
         raise Exception(f"Failed to select files: {response.text}")
 
     print("Video files selected for download.")
 
-    # Step 5: Check if the torrent is cached
+    # Step 5: Check if the torrent is cached (when instant availability couldn't tell)
     torrent_info = get_torrent_info(torrent_id)
     if torrent_info["status"] == "queued": # "waiting_files_selection":
         print("Torrent is not cached on Real-Debrid and needs to be downloaded.")
@@ -115,36 +744,40 @@ def upload_magnet_to_realdebrid(magnet_link, magnet_file_path=None):
         # Mark the release as failed in Sonarr or Radarr
         if magnet_file_path:
             release_title = os.path.basename(magnet_file_path).replace(".magnet", "").replace(".torrent", "")
-            search_and_mark_failed(release_title, magnet_file_path)
+            search_and_mark_failed(release_title, magnet_file_path, infohash)
         return None
 
 
     # Step 6: Wait for the torrent to finish downloading
-    while True:
-        torrent_info = get_torrent_info(torrent_id)
-        if torrent_info["status"] == "downloaded":
-            break
-        elif torrent_info["status"] == "error" or torrent_info["status"] == "dead":
-            print("Torrent encountered an error or is dead.")
-            remove_torrent(torrent_id)  # Remove the torrent if it encounters an error
-            # Mark the release as failed in Sonarr or Radarr
-            if magnet_file_path:
-                release_title = os.path.basename(magnet_file_path).replace(".magnet", "").replace(".torrent", "")
-                search_and_mark_failed(release_title, magnet_file_path)
-            return None
+    if torrent_info["status"] != "downloaded":
         print("Torrent is still downloading. Waiting...")
-        time.sleep(10)  # Wait 10 seconds before checking again
+        with span("rd.wait", torrent_id=torrent_id) as trace:
+            torrent_info = status_tracker.wait(torrent_id, stop_event)
+            trace.set(status=torrent_info and torrent_info["status"])
+        if torrent_info is None:
+            print(f"Stopped waiting for torrent {torrent_id}.")
+            return None
+    if torrent_info["status"] != "downloaded":
+        print("Torrent encountered an error or is dead.")
+        remove_torrent(torrent_id)  # Remove the torrent if it encounters an error
+        # Mark the release as failed in Sonarr or Radarr
+        if magnet_file_path:
+            release_title = os.path.basename(magnet_file_path).replace(".magnet", "").replace(".torrent", "")
+            search_and_mark_failed(release_title, magnet_file_path, infohash)
+        return None
 
 
     # Step 7: Delete the .magnet file if the path is provided
-    if magnet_file_path and os.path.exists(magnet_file_path):
+    if delete_magnet_file and magnet_file_path and os.path.exists(magnet_file_path):
         delete_file_with_retry(magnet_file_path)
 
 
     # Step 8: Return the filename and ID
     return {
         "id": torrent_info["id"],
-        "filename": video_files_names
+        "name": torrent_info.get("filename"),  # Torrent name, which zurg uses as its folder name
+        "filename": video_files_names,
+        "sizes": video_files_sizes  # Bytes of each file, as reported by Real-Debrid
     }
 # # Example usage
 # magnet_link = 'magnet:?xt=urn:btih:E738C8D2BA12C9923847935976D52F49D51070BA&dn=Cobra+Kai+S06+2160p+NF+WEB-DL+DV+HDR+H+265&tr=http%3a%2f%2ftracker.opentrackr.org%3a1337%2fannounce&tr=udp%3a%2f%2ftracker.auctor.tv%3a6969%2fannounce&tr=udp%3a%2f%2fopentracker.i2p.rocks%3a6969%2fannounce&tr=https%3a%2f%2fopentracker.i2p.rocks%3a443%2fannounce&tr=udp%3a%2f%2fopen.demonii.com%3a1337%2fannounce&tr=udp%3a%2f%2ftracker.openbittorrent.com%3a6969%2fannounce&tr=http%3a%2f%2ftracker.openbittorrent.com%3a80%2fannounce&tr=udp%3a%2f%2fopen.stealth.si%3a80%2fannounce&tr=udp%3a%2f%2ftracker.torrent.eu.org%3a451%2fannounce&tr=udp%3a%2f%2ftracker.moeking.me%3a6969%2fannounce&tr=udp%3a%2f%2fexplodie.org%3a6969%2fannounce&tr=udp%3a%2f%2fexodus.desync.com%3a6969%2fannounce&tr=udp%3a%2f%2fuploads.gamecoast.net%3a6969%2fannounce&tr=udp%3a%2f%2ftracker1.bt.moack.co.kr%3a80%2fannounce&tr=udp%3a%2f%2ftracker.tiny-vps.com%3a6969%2fannounce&tr=udp%3a%2f%2ftracker.theoks.net%3a6969%2fannounce&tr=udp%3a%2f%2ftracker.skyts.net%3a6969%2fannounce&tr=udp%3a%2f%2ftracker-udp.gbitt.info%3a80%2fannounce&tr=udp%3a%2f%2fopen.tracker.ink%3a6969%2fannounce&tr=udp%3a%2f%2fmovies.zs`w.ca%3a6969%2fannounce'
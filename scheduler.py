@@ -0,0 +1,118 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+retry_base_delay = float(os.getenv('RETRY_BASE_DELAY', 5))
+retry_max_delay = float(os.getenv('RETRY_MAX_DELAY', 300))
+
+
+class DeadlineScheduler:
+    """
+    Min-heap of items keyed by the time they are next due.
+
+    Each item is rescheduled with its own exponential backoff, can be woken to run
+    immediately, and pop_due() sleeps only until the earliest deadline instead of
+    polling on a fixed interval.
+    """
+
+    def __init__(self, base_delay=retry_base_delay, max_delay=retry_max_delay):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.heap = []  # (due, seq, key); entries whose due no longer matches self.items are stale
+        self.items = {}  # key -> (due, item)
+        self.attempts = {}  # key -> number of backoffs so far
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+
+    def schedule(self, key, item, due=None):
+        """
+        Schedule an item to be due at the given time (default: now), replacing any earlier schedule.
+        """
+        due = time.time() if due is None else due
+        with self.condition:
+            self.items[key] = (due, item)
+            heapq.heappush(self.heap, (due, next(self.counter), key))
+            self.condition.notify()
+
+    def backoff(self, key, item):
+        """
+        Reschedule an item after its next exponential backoff delay. Returns the new due time.
+        """
+        with self.condition:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+        due = time.time() + min(self.max_delay, self.base_delay * 2 ** attempt)
+        self.schedule(key, item, due)
+        return due
+
+    def wake(self, key):
+        """
+        Make a scheduled item due now. Returns False if the item isn't scheduled.
+        """
+        with self.condition:
+            if key not in self.items:
+                return False
+            _, item = self.items[key]
+        self.schedule(key, item)
+        return True
+
+    def wake_all(self):
+        """
+        Make every scheduled item due now.
+        """
+        with self.condition:
+            items = [(key, item) for key, (_, item) in self.items.items()]
+        for key, item in items:
+            self.schedule(key, item)
+
+    def remove(self, key):
+        """
+        Forget an item and its backoff.
+        """
+        with self.condition:
+            self.items.pop(key, None)
+            self.attempts.pop(key, None)
+
+    def pop_due(self, timeout=None):
+        """
+        Wait until an item is due and return it, removing it from the schedule.
+        Returns None on timeout or once stop() has been called.
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.running:
+                now = time.time()
+                while self.heap:
+                    due, _, key = self.heap[0]
+                    if key in self.items and self.items[key][0] == due:
+                        break
+                    heapq.heappop(self.heap)  # Stale entry
+                if self.heap and self.heap[0][0] <= now:
+                    _, _, key = heapq.heappop(self.heap)
+                    _, item = self.items.pop(key)
+                    return item
+
+                wait_time = self.heap[0][0] - now if self.heap else None
+                if end is not None:
+                    if now >= end:
+                        return None
+                    wait_time = end - now if wait_time is None else min(wait_time, end - now)
+                self.condition.wait(wait_time)
+            return None
+
+    def __len__(self):
+        with self.condition:
+            return len(self.items)
+
+    def stop(self):
+        """
+        Wake any waiting pop_due() and make it return None.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
@@ -0,0 +1,77 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ARR_TORRENTS_PATH', '/tmp/blackhole-tests/torrents')
+os.environ.setdefault('ARR_DOWNLOAD_PATH', '/tmp/blackhole-tests/downloads')
+
+from arrs import ArrHistoryCache
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeHistory:
+    """
+    Stand-in for the arr history endpoint, paging grab records newest first.
+    """
+
+    def __init__(self, count):
+        self.records = []
+        for _ in range(count):
+            self.grab()
+
+    def grab(self):
+        record_id = len(self.records) + 1
+        self.records.append({"id": record_id, "sourceTitle": f"T{record_id}", "downloadId": f"H{record_id}"})
+
+    def get(self, url, params=None):
+        newest_first = self.records[::-1]
+        start = (params["page"] - 1) * params["pageSize"]
+        return FakeResponse({"records": newest_first[start:start + params["pageSize"]]})
+
+
+def history_cache(history, max_records, page_size):
+    cache = ArrHistoryCache('sonarr', 'http://arr', 'key', max_records=max_records, page_size=page_size,
+                            min_refresh_interval=0)
+    cache.session = history
+    return cache
+
+
+class ArrHistoryCacheTest(unittest.TestCase):
+
+    def test_cold_fill_keeps_the_newest_grabs(self):
+        cache = history_cache(FakeHistory(10), max_records=5, page_size=3)
+        self.assertEqual(cache.find('T10')["id"], 10)
+        self.assertEqual(sorted(cache.records), [6, 7, 8, 9, 10])
+        self.assertIsNone(cache._lookup('T5', None))
+
+    def test_new_grab_evicts_the_oldest(self):
+        history = FakeHistory(10)
+        cache = history_cache(history, max_records=5, page_size=3)
+        cache.find('T10')
+        history.grab()
+        self.assertEqual(cache.find(download_id='h11')["id"], 11)
+        self.assertEqual(list(cache.records), [7, 8, 9, 10, 11])
+
+    def test_lookups_protect_records_from_eviction(self):
+        history = FakeHistory(5)
+        cache = history_cache(history, max_records=5, page_size=250)
+        cache.find('T1')  # Now the most recently used
+        history.grab()
+        cache.find('T6')
+        self.assertIn(1, cache.records)
+        self.assertNotIn(2, cache.records)
+
+
+if __name__ == '__main__':
+    unittest.main()
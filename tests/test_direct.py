@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ARR_TORRENTS_PATH', '/tmp/blackhole-tests/torrents')
+os.environ.setdefault('ARR_DOWNLOAD_PATH', '/tmp/blackhole-tests/downloads')
+
+from bench.fake_rd import FakeRealDebrid, file_content, serve
+from direct import DownloadError, SegmentedDownload
+
+SIZE = 4 * 256 * 1024
+SEGMENTS = 4
+
+
+class RecordingSession:
+    """
+    Session that records the Range of every request and fails the requests for one offset.
+    """
+
+    def __init__(self, fail_offset=None):
+        self.session = requests.Session()
+        self.fail_offset = fail_offset
+        self.ranges = []
+
+    def get(self, url, headers, **kwargs):
+        self.ranges.append(headers["Range"])
+        if headers["Range"].startswith(f"bytes={self.fail_offset}-"):
+            raise requests.exceptions.ConnectionError("connection reset")
+        return self.session.get(url, headers=headers, **kwargs)
+
+
+class CountingDownload(SegmentedDownload):
+    saves = 0
+
+    def _save_state(self):
+        self.saves += 1
+        super()._save_state()
+
+
+class SegmentedDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='blackhole-direct-')
+        self.path = os.path.join(self.folder, 'Show.S01E01.mkv.partial')
+        fake = FakeRealDebrid()
+        fake.torrents['T1'] = {"files": [{"id": 1, "bytes": SIZE, "selected": 1}]}
+        self.server = serve(fake)
+        self.url = f"{fake.base_url}/_download/T1/1"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def download(self, session, throttle=None):
+        return CountingDownload(session, self.url, self.path, SIZE, SEGMENTS, max_retries=1, throttle=throttle)
+
+    def test_failed_segment_stops_the_others_and_resumes(self):
+        # The first segment always fails; the others are slowed down so they are still running
+        session = RecordingSession(fail_offset=0)
+        download = self.download(session, throttle=lambda size: time.sleep(0.05))
+        started = time.monotonic()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            download.run()
+        self.assertLess(time.monotonic() - started, 3)
+        self.assertLess(download.saves, 5)
+
+        with open(f"{self.path}.segments") as f:
+            saved = json.load(f)["segments"]
+        self.assertEqual(saved[0][2], 0)
+        self.assertTrue(all(0 < done < end + 1 - start for start, end, done in saved[1:]))
+
+        session = RecordingSession()
+        resumed = self.download(session)
+        resumed.run()
+        self.assertEqual(sorted(session.ranges),
+                         sorted(f"bytes={start + done}-{end}" for start, end, done in saved))
+        self.assertEqual(resumed.downloaded(), SIZE)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), file_content('T1', '1', 0, SIZE))
+
+    def test_empty_partial_response_is_a_failed_attempt(self):
+        session = RecordingSession()
+        download = self.download(session)
+        download.segments = [[SIZE, SIZE + 10, 0]]  # Past the end of the file: the server sends no data
+        download.stopped.wait = lambda delay: None
+        with self.assertRaises(DownloadError):
+            download.run()
+        self.assertEqual(len(session.ranges), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
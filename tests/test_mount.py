@@ -0,0 +1,109 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_mount_api import FakeRcloneRC, FakeZurg
+from bench.fake_rd import serve
+from mount import MountIndex, RcloneRCSource, ZurgSource
+
+
+class FakeHandler:
+    def __init__(self, rclone_folder):
+        self.mount_index = MountIndex(rclone_folder)
+        self.mount_index.build()
+
+
+class MountIndexTest(unittest.TestCase):
+
+    def test_lookup_only_in_given_folders(self):
+        index = MountIndex('/mount')
+        index.build()
+        index.add('/mount/Old.Show.S01/Show.S01E01.mkv')
+        self.assertIsNone(index.lookup('Show.S01E01.mkv', ['Show.S01.REPACK']))
+        self.assertEqual(index.lookup('Show.S01E01.mkv'), '/mount/Old.Show.S01/Show.S01E01.mkv')
+
+        index.add('/mount/Show.S01.REPACK/Show.S01E01.mkv')
+        self.assertEqual(index.lookup('Show.S01E01.mkv', ['Show.S01.REPACK']),
+                         '/mount/Show.S01.REPACK/Show.S01E01.mkv')
+
+
+class MountSourceTests:
+    """
+    Runs a mount source against a fake listing API backed by a temporary remote, whose
+    __all__ folder is the rclone folder.
+    """
+
+    def create_source(self, handler, fake):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.remote = tempfile.mkdtemp(prefix='blackhole-mount-')
+        self.rclone_folder = os.path.join(self.remote, '__all__')
+        os.makedirs(self.rclone_folder)
+        self.server = serve(self.fake_class(self.remote))
+        self.handler = FakeHandler(self.rclone_folder)
+        self.source = self.create_source(self.handler, self.server.fake)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.remote)
+
+    def write(self, *parts):
+        path = os.path.join(self.rclone_folder, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        return path
+
+    def test_missing_folder(self):
+        self.assertIsNone(self.source.list_folder('Show.S01.1080p'))
+
+    def test_lists_files_only(self):
+        self.write('Show S01 [1080p]', 'Show S01E01 & more.mkv')
+        self.write('Show S01 [1080p]', 'Subs', 'en.srt')
+        self.assertEqual(self.source.list_folder('Show S01 [1080p]'), {'Show S01E01 & more.mkv'})
+
+    def test_poll_updates_mount_index(self):
+        self.source.watch('Show.S01')
+        self.source.poll()
+        self.assertIsNone(self.handler.mount_index.lookup('Show.S01E01.mkv'))
+
+        first = self.write('Show.S01', 'Show.S01E01.mkv')
+        self.write('Other', 'Other.mkv')
+        self.source.poll()
+        self.assertEqual(self.handler.mount_index.lookup('Show.S01E01.mkv'), first)
+        self.assertIsNone(self.handler.mount_index.lookup('Other.mkv'))
+
+        os.remove(first)
+        second = self.write('Show.S01', 'Show.S01E02.mkv')
+        self.source.poll()
+        self.assertIsNone(self.handler.mount_index.lookup('Show.S01E01.mkv'))
+        self.assertEqual(self.handler.mount_index.lookup('Show.S01E02.mkv'), second)
+
+
+class RcloneRCSourceTest(MountSourceTests, unittest.TestCase):
+    fake_class = FakeRcloneRC
+
+    def create_source(self, handler, fake):
+        return RcloneRCSource(handler, self.rclone_folder, rc_url=fake.base_url, rc_fs='zurg:')
+
+    def test_refreshes_before_listing(self):
+        self.write('Show.S01', 'Show.S01E01.mkv')
+        self.source.list_folder('Show.S01')
+        self.assertEqual(self.server.fake.calls, {'POST vfs/refresh': 1, 'POST operations/list': 1})
+
+
+class ZurgSourceTest(MountSourceTests, unittest.TestCase):
+    fake_class = FakeZurg
+
+    def create_source(self, handler, fake):
+        return ZurgSource(handler, self.rclone_folder, url=fake.base_url, directory='__all__')
+
+
+if __name__ == '__main__':
+    unittest.main()
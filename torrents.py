@@ -1,8 +1,11 @@
 from dotenv import load_dotenv
 import os.path
-import bencodepy
+import base64
 import hashlib
+import mmap
 import time
+from urllib.parse import urlparse, parse_qs, quote
+from tracing import span
 
 load_dotenv()
 
@@ -11,34 +14,200 @@ def get_extension(torrent_file_path):
     return extension
 
 
-def extract_magnet_from_torrent(torrent_file_path):
+class BencodeError(ValueError):
+    pass
+
+
+def _bencode_skip(buf, pos):
+    """
+    Return the position just after the bencoded value starting at pos, without decoding it.
+    """
+    token = buf[pos:pos + 1]
+    if token == b'i':
+        end = buf.find(b'e', pos)
+        if end < 0:
+            raise BencodeError(f"Unterminated integer at {pos}")
+        return end + 1
+    if token in (b'l', b'd'):
+        pos += 1
+        while buf[pos:pos + 1] != b'e':
+            if pos >= len(buf):
+                raise BencodeError("Unterminated list or dictionary")
+            pos = _bencode_skip(buf, pos)
+        return pos + 1
+    if token.isdigit():
+        colon = buf.find(b':', pos)
+        if colon < 0:
+            raise BencodeError(f"Invalid string length at {pos}")
+        end = colon + 1 + int(buf[pos:colon])
+        if end > len(buf):
+            raise BencodeError(f"String at {pos} runs past the end of the file")
+        return end
+    raise BencodeError(f"Invalid bencode token {token!r} at {pos}")
+
+
+def _bencode_decode(buf, pos):
+    """
+    Decode the bencoded value starting at pos. Returns (value, end position).
+    Only used for the small values the scanner needs; large strings are skipped instead.
+    """
+    token = buf[pos:pos + 1]
+    if token == b'i':
+        end = buf.find(b'e', pos)
+        return int(buf[pos + 1:end]), end + 1
+    if token == b'l':
+        items = []
+        pos += 1
+        while buf[pos:pos + 1] != b'e':
+            item, pos = _bencode_decode(buf, pos)
+            items.append(item)
+        return items, pos + 1
+    if token == b'd':
+        items = {}
+        pos += 1
+        while buf[pos:pos + 1] != b'e':
+            key, pos = _bencode_decode(buf, pos)
+            items[key], pos = _bencode_decode(buf, pos)
+        return items, pos + 1
+    end = _bencode_skip(buf, pos)
+    return bytes(buf[buf.find(b':', pos) + 1:end]), end
+
+
+def _bencode_dict_items(buf, pos):
+    """
+    Yield (key, value start, value end) for each entry of the dictionary starting at pos.
+    """
+    if buf[pos:pos + 1] != b'd':
+        raise BencodeError(f"Expected a dictionary at {pos}")
+    pos += 1
+    while buf[pos:pos + 1] != b'e':
+        key, pos = _bencode_decode(buf, pos)
+        end = _bencode_skip(buf, pos)
+        yield key, pos, end
+        pos = end
+
+
+def _file_tree_files(tree, parents=()):
+    """
+    Flatten a BitTorrent v2 'file tree' into (path, length) tuples.
+    """
+    files = []
+    for name, node in tree.items():
+        if name == b'':
+            files.append(("/".join(part.decode(errors='replace') for part in parents), node.get(b'length', 0)))
+        else:
+            files.extend(_file_tree_files(node, parents + (name,)))
+    return files
+
+
+def scan_torrent(torrent_file_path):
     """
-    Extract the magnet link from a .torrent file using bencode.py.
+    Scan a .torrent file without decoding its piece tables.
+
+    The file is memory-mapped and walked once: the raw bytes of the 'info' dictionary are
+    hashed in place (so non-canonical torrents keep their real infohash), and the name, the
+    file list with sizes and the trackers are picked out on the way. Returns a dict with
+    'infohash', 'infohash_v2' (the SHA-256 of hybrid/v2 torrents, else None), 'name',
+    'files' [(path, length)] and 'trackers'.
     """
-    # Read the torrent file
     with open(torrent_file_path, 'rb') as f:
-        torrent_data = f.read()
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files can't be mapped
+            raise BencodeError(f"Empty torrent file: {torrent_file_path}")
 
-    # Decode the torrent file
-    metadata = bencodepy.decode(torrent_data)
+    try:
+        metadata = {"infohash": None, "infohash_v2": None, "name": None, "files": [], "trackers": []}
+        info_span = None
+        for key, start, end in _bencode_dict_items(buf, 0):
+            if key == b'info':
+                info_span = (start, end)
+            elif key == b'announce':
+                metadata["trackers"].append(_bencode_decode(buf, start)[0].decode(errors='replace'))
+            elif key == b'announce-list':
+                for tier in _bencode_decode(buf, start)[0]:
+                    metadata["trackers"].extend(tracker.decode(errors='replace') for tracker in tier)
+        if info_span is None:
+            raise BencodeError(f"No info dictionary in {torrent_file_path}")
 
-    # Calculate the info hash
-    info = metadata[b'info']
-    info_hash = hashlib.sha1(bencodepy.encode(info)).digest()
-    info_hash_hex = info_hash.hex()
+        length = None
+        meta_version = 1
+        file_tree = {}
+        for key, start, end in _bencode_dict_items(buf, info_span[0]):
+            if key in (b'name', b'name.utf-8'):
+                if key == b'name.utf-8' or metadata["name"] is None:
+                    metadata["name"] = _bencode_decode(buf, start)[0].decode(errors='replace')
+            elif key == b'length':
+                length = _bencode_decode(buf, start)[0]
+            elif key == b'files':
+                for entry in _bencode_decode(buf, start)[0]:
+                    path = entry.get(b'path.utf-8') or entry.get(b'path', [])
+                    metadata["files"].append(("/".join(part.decode(errors='replace') for part in path),
+                                              entry.get(b'length', 0)))
+            elif key == b'file tree':
+                file_tree = _bencode_decode(buf, start)[0]
+            elif key == b'meta version':
+                meta_version = _bencode_decode(buf, start)[0]
 
-    # Create the magnet link
-    magnet_link = f"magnet:?xt=urn:btih:{info_hash_hex}&dn={metadata[b'info'][b'name'].decode()}"
+        # Hash the raw info bytes straight from the map, without copying the piece table
+        with memoryview(buf) as view, view[info_span[0]:info_span[1]] as info:
+            metadata["infohash"] = hashlib.sha1(info).hexdigest()
+            if meta_version >= 2:
+                metadata["infohash_v2"] = hashlib.sha256(info).hexdigest()
+
+        if meta_version >= 2:
+            if not metadata["files"] and length is None:
+                metadata["files"] = _file_tree_files(file_tree)
+        if not metadata["files"] and length is not None:
+            metadata["files"] = [(metadata["name"], length)]
+        metadata["trackers"] = list(dict.fromkeys(metadata["trackers"]))
+        return metadata
+    finally:
+        buf.close()
+
+
+def extract_magnet_from_torrent(torrent_file_path):
+    """
+    Extract the magnet link from a .torrent file.
+    """
+    metadata = scan_torrent(torrent_file_path)
 
-    f.close()
+    # Create the magnet link
+    magnet_link = f"magnet:?xt=urn:btih:{metadata['infohash']}"
+    if metadata["infohash_v2"]:
+        magnet_link += f"&xt=urn:btmh:1220{metadata['infohash_v2']}"
+    magnet_link += f"&dn={quote(metadata['name'] or '')}"
+    for tracker in metadata["trackers"]:
+        magnet_link += f"&tr={quote(tracker, safe='')}"
     return magnet_link
 
+def get_infohash(magnet_link):
+    """
+    Return the lowercase hex BitTorrent v1 infohash of a magnet link, or None if it has none.
+    Base32 infohashes are converted to hex.
+    """
+    if not magnet_link:
+        return None
+    for xt in parse_qs(urlparse(magnet_link).query).get('xt', []):
+        if xt.lower().startswith('urn:btih:'):
+            infohash = xt[len('urn:btih:'):]
+            if len(infohash) == 32:
+                infohash = base64.b32decode(infohash.upper()).hex()
+            return infohash.lower()
+    return None
+
 def read_magnet_file(file_path):
     """
     Read a .magnet or .torrent file and extract the magnet link.
     If it's a .torrent file, extract the magnet link from the torrent file.
     If it's a .magnet file, read the magnet link directly.
     """
+    with span("magnet.read", file=os.path.basename(file_path)) as trace:
+        magnet_link = _read_magnet_file(file_path)
+        trace.set(infohash=get_infohash(magnet_link))
+        return magnet_link
+
+def _read_magnet_file(file_path):
     try:
         # Check the file extension
         _, extension = os.path.splitext(file_path)
@@ -0,0 +1,226 @@
+"""
+Per-job tracing.
+
+Spans record how long each step of a job took and are keyed by the infohash of its torrent,
+so the whole life of one release can be followed across the magnet workers, the Real-Debrid
+client and the copy slots. They are written as JSON lines to a rotating file (TRACE_FILE)
+and can be converted to a Chrome trace-event file, with one timeline row per torrent:
+
+    python tracing.py trace.jsonl -o trace.json
+
+and opened in chrome://tracing or https://ui.perfetto.dev.
+Until start_tracing() is called with a TRACE_FILE, span() returns a shared no-op span.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from dotenv import load_dotenv
+
+load_dotenv()
+trace_file = os.getenv('TRACE_FILE')
+trace_max_bytes = int(float(os.getenv('TRACE_MAX_MB', 50)) * 1024 * 1024)
+trace_backups = int(os.getenv('TRACE_BACKUPS', 5))
+
+current = threading.local()  # .infohash of the job the thread is working on
+
+
+class NoopSpan:
+    """
+    Span returned while tracing is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    """
+    One timed step of a job. Attributes can be added with set() while it runs.
+    """
+    __slots__ = ('name', 'infohash', 'attrs', 'wall', 'start')
+
+    def __init__(self, name, infohash, attrs):
+        self.name = name
+        self.infohash = infohash
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {
+            "name": self.name,
+            "infohash": self.infohash or getattr(current, 'infohash', None),
+            "ts": self.wall,
+            "dur": time.perf_counter() - self.start,
+            "thread": threading.current_thread().name,
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        logger.info(json.dumps(record, default=str))
+        return False
+
+    def set(self, infohash=None, **attrs):
+        if infohash:
+            self.infohash = infohash
+        self.attrs.update(attrs)
+
+
+class TraceJob:
+    """
+    Ties the spans of the current thread to a torrent until it exits.
+    """
+    __slots__ = ('infohash', 'previous')
+
+    def __init__(self, infohash):
+        self.infohash = infohash
+
+    def __enter__(self):
+        self.previous = getattr(current, 'infohash', None)
+        current.infohash = self.infohash
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current.infohash = self.previous
+        return False
+
+
+def trace_job(infohash):
+    """
+    Return a context manager that keys the spans of the current thread by infohash, e.g.
+
+        with trace_job(infohash):
+            upload_magnet_to_realdebrid(...)
+    """
+    if listener is None:
+        return NOOP_SPAN
+    return TraceJob(infohash)
+
+
+def span(name, infohash=None, **attrs):
+    """
+    Return a context manager that records a span named name, keyed by infohash
+    (default: the torrent of the current job, see trace_job()).
+    """
+    if listener is None:
+        return NOOP_SPAN
+    return Span(name, infohash, attrs)
+
+
+def start_tracing(path=trace_file, max_bytes=trace_max_bytes, backups=trace_backups):
+    """
+    Start writing spans to path. Spans are handed to a background thread, so the
+    threads being traced never wait on the file.
+    """
+    global listener
+    if listener is not None or not path:
+        return
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(records))
+    listener = QueueListener(records, file_handler)
+    listener.start()
+    print(f"Writing trace spans to {path}")
+
+
+def stop_tracing():
+    """
+    Write the spans still queued and close the trace file.
+    """
+    global listener
+    if listener is None:
+        return
+    running, listener = listener, None
+    running.stop()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for handler in running.handlers:
+        handler.close()
+
+
+logger = logging.getLogger('blackhole.trace')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+listener = None
+
+
+def read_spans(paths):
+    """
+    Yield the spans of trace files, including their rotated backups, oldest file first.
+    """
+    for path in paths:
+        backups = sorted(glob.glob(f"{glob.escape(path)}.[0-9]*"), key=lambda p: int(p.rsplit('.', 1)[1]),
+                         reverse=True)
+        for file_path in backups + [path]:
+            with open(file_path) as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue  # Cut off by a crash
+
+
+def export_chrome_trace(paths, output, infohashes=None):
+    """
+    Convert trace files to a Chrome trace-event file with one row per torrent.
+    Spans that belong to no torrent (e.g. the shared status poll) get a row per thread.
+    Pass infohashes to keep only those torrents. Returns the number of spans exported.
+    """
+    rows = {}  # infohash or thread -> tid
+    labels = {}  # tid -> row name
+    events = []
+    for record in read_spans(paths):
+        infohash = record.get("infohash")
+        if infohashes and infohash not in infohashes:
+            continue
+        key = infohash or f"thread {record.get('thread')}"
+        tid = rows.setdefault(key, len(rows) + 1)
+        args = dict(record.get("attrs") or {}, thread=record.get("thread"))
+        if record.get("error"):
+            args["error"] = record["error"]
+        if infohash and args.get("file") and record["name"] == "magnet.read":
+            labels[tid] = f"{args['file']} ({infohash[:8]})"
+        events.append({"name": record["name"], "cat": record["name"].split('.')[0], "ph": "X", "pid": 1,
+                       "tid": tid, "ts": record["ts"] * 1e6, "dur": record["dur"] * 1e6, "args": args})
+    events.append({"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "blackhole"}})
+    for key, tid in rows.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": labels.get(tid, key)}})
+        events.append({"name": "thread_sort_index", "ph": "M", "pid": 1, "tid": tid, "args": {"sort_index": tid}})
+    with open(output, 'w') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events) - 1 - 2 * len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert blackhole trace files to a Chrome trace-event file")
+    parser.add_argument('paths', nargs='+', help="Trace files (TRACE_FILE); rotated backups are included")
+    parser.add_argument('-o', '--output', default='trace.json')
+    parser.add_argument('--infohash', action='append', help="Only export this torrent (repeatable)")
+    args = parser.parse_args(argv)
+    infohashes = {infohash.lower() for infohash in args.infohash} if args.infohash else None
+    count = export_chrome_trace(args.paths, args.output, infohashes)
+    print(f"Exported {count} spans to {args.output}")
+
+
+if __name__ == '__main__':
+    main()